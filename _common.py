@@ -0,0 +1,91 @@
+import os
+import queue
+import shelve
+import threading
+import time
+from concurrent.futures import Future
+
+# Persistent cache shared by all the AgriVerse tools
+CACHE_FILE = ".agriverse_cache"
+_cache_lock = threading.Lock()
+
+def cache_disabled():
+    """True when AGRIVERSE_NO_CACHE=1 asks for fresh data on every call"""
+    # Read per call, so a value loaded from .env after import still applies
+    return os.getenv("AGRIVERSE_NO_CACHE") == "1"
+
+def cache_get(key, ttl):
+    """Return a cached value if it is younger than ttl seconds, else None"""
+    if cache_disabled():
+        return None
+    try:
+        with _cache_lock, shelve.open(CACHE_FILE) as cache:
+            entry = cache.get(key)
+    except Exception as e:
+        print(f"⚠️ Cache read failed: {str(e)}")
+        return None
+    if entry and time.time() - entry[0] < ttl:
+        return entry[1]
+    return None
+
+def cache_set(key, value):
+    """Store a value in the persistent cache"""
+    if cache_disabled():
+        return
+    try:
+        with _cache_lock, shelve.open(CACHE_FILE) as cache:
+            cache[key] = (time.time(), value)
+    except Exception as e:
+        print(f"⚠️ Cache write failed: {str(e)}")
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls out to at most max_calls per period seconds"""
+    
+    def __init__(self, max_calls, period):
+        self.interval = period / max_calls
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+    
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+class DaemonExecutor:
+    """Minimal thread pool for calls that may be abandoned (timed-out or no longer needed).
+    
+    concurrent.futures joins its workers when the interpreter exits, before any atexit handler
+    could shut the pool down, so an abandoned agent run would keep the CLI from exiting until it
+    finished. These workers are daemon threads and are dropped at exit instead. Workers are
+    started on first use and kept, so thread-local agents survive between calls.
+    """
+    
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._started = False
+    
+    def submit(self, func, *args):
+        with self._lock:
+            if not self._started:
+                for _ in range(self.max_workers):
+                    threading.Thread(target=self._work, daemon=True).start()
+                self._started = True
+        future = Future()
+        self._queue.put((future, func, args))
+        return future
+    
+    def _work(self):
+        while True:
+            future, func, args = self._queue.get()
+            # Futures cancelled while queued are skipped
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
@@ -0,0 +1,223 @@
+import os
+import json
+import re
+import threading
+from typing import Dict, Optional
+from _common import DaemonExecutor, cache_get, cache_set
+
+STRICT_STATS_TTL = 30 * 24 * 3600  # Per-commodity strict-query hit rates, kept across runs
+
+class _BaseFetcher:
+    """Price prompt, response parsing and agent pooling shared by the commodity price fetchers."""
+    
+    SYSTEM_PROMPT = """You are a highly specialized agricultural price analyst for Indian markets.
+Your goal is to provide the most accurate price in INR per **KILOGRAM (kg)** from multiple official sources.
+
+Follow these steps precisely:
+1. Search for the CURRENT/latest wholesale/mandi price for the commodity from at least 2-4 official sources (eNAM, Agmarknet, APMC data, government reports).
+2. For each source, extract:
+   - The price (likely in INR per Quintal (100 kg))
+   - The date of the price data
+   - The source name
+3. **For each source, convert the price to INR per kg** (divide quintal price by 100).
+4. Identify the most recent date among all sources.
+5. Provide your final response as a single JSON object and nothing else (no markdown, no commentary):
+
+{"prices": [{"price_per_kg": <number>, "source": "<source>", "date": "<YYYY-MM-DD>"}, ...],
+ "ranges": [{"min_price_kg": <number>, "max_price_kg": <number>, "source": "<source>", "date": "<YYYY-MM-DD>"}, ...],
+ "latest_date": "<most recent date, YYYY-MM-DD>"}
+
+Use "prices" for single prices and "ranges" for sources that only give a min/max range; leave the other list empty.
+
+If after a thorough search, no current data is found from official sources, return the single phrase: 'Not available'.
+"""
+
+    QUALITY_PRICE_FACTORS = {'A': 1.15, 'B': 1.0, 'C': 0.85}
+    
+    # Precompiled patterns for parsing the agent's price answers
+    _PRICE_CLEAN_RE = re.compile(r"[^\d.]")
+    # KEY: value pairs, tolerating markdown bold around the key and any surrounding text
+    _KV_RE = re.compile(
+        r"\b(PRICE_PER_KG|MIN_PRICE_KG|MAX_PRICE_KG|LATEST_DATE|SOURCE|DATE)\b\**\s*:\s*([^|\n]+)",
+        re.I
+    )
+    _FENCE_RE = re.compile(r"^\s*```.*$", re.M)
+    # The outermost {...} object of a JSON answer
+    _JSON_RE = re.compile(r"\{.*\}", re.S)
+    
+    # Below this strict-query success rate, the broader fallback query is launched in parallel
+    SPECULATIVE_FALLBACK_THRESHOLD = 0.6
+    # Runs the strict and fallback queries of speculative searches (5 concurrent lookups x 2);
+    # long-lived, so each worker keeps its agent, and daemon, so an unneeded fallback that is
+    # still running never delays the exit
+    _query_executor = DaemonExecutor(max_workers=10)
+    
+    def __init__(self):
+        self.api_keys_configured = self._check_api_keys()
+        if self.api_keys_configured:
+            import google.generativeai as genai
+            genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        # phi agents keep per-run state, so each worker thread gets its own price agent
+        self._local = threading.local()
+        # Guards the read-modify-write of the strict-query stats
+        self._stats_lock = threading.Lock()
+    
+    def _check_api_keys(self) -> bool:
+        required_keys = {"TAVILY_API_KEY": os.getenv("TAVILY_API_KEY"), "GOOGLE_API_KEY": os.getenv("GOOGLE_API_KEY")}
+        missing_keys = [k for k, v in required_keys.items() if not v]
+        if missing_keys:
+            print(f"Warning: Missing API keys: {', '.join(missing_keys)}. Some services may not work.")
+            return False
+        return True
+    
+    def _search_price_text(self, commodity_name: str, log=print) -> str:
+        """Run the strict search, falling back to a broader one when it finds nothing.
+        
+        Subclasses provide _run_price_query. Progress messages go to log.
+        """
+        # Initial query for multiple sources
+        query = f"Current wholesale prices for {commodity_name} in India from 2-4 official sources with dates"
+        alt_query = f"Latest mandi prices for {commodity_name} in India from any reliable sources"
+        
+        if self._strict_hit_rate(commodity_name) < self.SPECULATIVE_FALLBACK_THRESHOLD:
+            # The strict query often fails for this commodity, so run the fallback alongside it
+            # instead of waiting for the strict answer first
+            strict_future = self._query_executor.submit(self._run_price_query, query)
+            alt_future = self._query_executor.submit(self._run_price_query, alt_query)
+            response_text = strict_future.result()
+            strict_ok = "not available" not in response_text.lower()
+            self._record_strict_result(commodity_name, strict_ok)
+            if strict_ok:
+                # The fallback isn't waited for; if it hasn't started yet it doesn't run at all
+                alt_future.cancel()
+            else:
+                alt_text = alt_future.result()
+                if "not available" not in alt_text.lower():
+                    response_text = alt_text
+            return response_text
+        
+        response_text = self._run_price_query(query)
+        strict_ok = "not available" not in response_text.lower()
+        self._record_strict_result(commodity_name, strict_ok)
+
+        # Fallback mechanism if initial search fails
+        if not strict_ok:
+            log("\nInitial search was too specific. Trying a broader query...")
+            alt_text = self._run_price_query(alt_query)
+            if "not available" not in alt_text.lower():
+                response_text = alt_text
+
+        return response_text
+
+    def _strict_hit_rate(self, commodity_name: str) -> float:
+        """Share of strict queries for this commodity that returned prices (optimistic when unseen)."""
+        hits, attempts = cache_get(f"strict_stats:{commodity_name.strip().lower()}", STRICT_STATS_TTL) or (0, 0)
+        return hits / attempts if attempts else 1.0
+
+    def _record_strict_result(self, commodity_name: str, success: bool):
+        key = f"strict_stats:{commodity_name.strip().lower()}"
+        with self._stats_lock:
+            hits, attempts = cache_get(key, STRICT_STATS_TTL) or (0, 0)
+            cache_set(key, (hits + int(success), attempts + 1))
+
+    def _parse_price_response(self, response_text: str) -> Dict:
+        """Parses the response with multiple sources and dates."""
+        data = {
+            "prices": [],
+            "ranges": [],
+            "latest_date": None,
+            "sources": set()
+        }
+        
+        if "not available" in response_text.lower():
+            return data
+        
+        try:
+            # Drop ``` fences so a fenced answer parses the same as a bare one
+            response_text = self._FENCE_RE.sub("", response_text)
+            
+            json_data = self._load_price_json(response_text)
+            if json_data is not None:
+                return self._parse_price_json(json_data, data)
+            
+            # Older snapshot entries and answers that drifted from JSON use the KEY: value grammar.
+            # Each line is one price entry; pull out its fields wherever they appear in the line
+            for entry in response_text.split('\n'):
+                entry_data = {
+                    m.group(1).upper(): m.group(2).strip(" *")
+                    for m in self._KV_RE.finditer(entry)
+                }
+                if not entry_data:
+                    continue
+                
+                if "LATEST_DATE" in entry_data:
+                    data["latest_date"] = entry_data["LATEST_DATE"]
+                    continue
+                
+                if "PRICE_PER_KG" in entry_data:
+                    data["prices"].append(entry_data)
+                    data["sources"].add(entry_data.get("SOURCE", "Unknown"))
+                elif "MIN_PRICE_KG" in entry_data and "MAX_PRICE_KG" in entry_data:
+                    data["ranges"].append(entry_data)
+                    data["sources"].add(entry_data.get("SOURCE", "Unknown"))
+            
+            return data
+            
+        except Exception as e:
+            print(f"Error parsing price response: {e}")
+            return data
+
+    def _load_price_json(self, response_text: str) -> Optional[Dict]:
+        """Return the JSON object in the answer, or None if there isn't a valid one."""
+        match = self._JSON_RE.search(response_text)
+        if not match:
+            return None
+        try:
+            json_data = json.loads(match.group(0))
+        except ValueError:
+            return None
+        return json_data if isinstance(json_data, dict) else None
+
+    def _parse_price_json(self, json_data: Dict, data: Dict) -> Dict:
+        """Map a JSON price answer onto the parsed-price structure, dropping malformed entries."""
+        for item in json_data.get("prices") or []:
+            if isinstance(item, dict) and item.get("price_per_kg") is not None:
+                entry = {"PRICE_PER_KG": str(item["price_per_kg"])}
+                data["prices"].append(self._with_source_and_date(entry, item, data))
+        for item in json_data.get("ranges") or []:
+            if isinstance(item, dict) and item.get("min_price_kg") is not None and item.get("max_price_kg") is not None:
+                entry = {"MIN_PRICE_KG": str(item["min_price_kg"]), "MAX_PRICE_KG": str(item["max_price_kg"])}
+                data["ranges"].append(self._with_source_and_date(entry, item, data))
+        if json_data.get("latest_date"):
+            data["latest_date"] = str(json_data["latest_date"])
+        return data
+
+    def _with_source_and_date(self, entry: Dict, item: Dict, data: Dict) -> Dict:
+        if item.get("source"):
+            entry["SOURCE"] = str(item["source"])
+        if item.get("date"):
+            entry["DATE"] = str(item["date"])
+        data["sources"].add(entry.get("SOURCE", "Unknown"))
+        return entry
+
+    def _has_complete_json(self, text: str) -> bool:
+        """True once the text ends with a JSON price object that parses and has data."""
+        if not text.rstrip().rstrip("`").rstrip().endswith("}"):
+            return False
+        json_data = self._load_price_json(text)
+        return json_data is not None and bool(json_data.get("prices") or json_data.get("ranges"))
+
+    def _get_price_agent(self):
+        """Return this thread's price agent, creating it on first use."""
+        price_agent = getattr(self._local, "price_agent", None)
+        if price_agent is None:
+            from phi.agent import Agent
+            from phi.model.google import Gemini
+            from phi.tools.tavily import TavilyTools
+            
+            price_agent = self._local.price_agent = Agent(
+                model=Gemini(model="gemini-1.5-flash"),
+                system_prompt=self.SYSTEM_PROMPT,
+                tools=[TavilyTools()],
+            )
+        return price_agent
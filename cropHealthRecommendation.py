@@ -1,69 +1,212 @@
 import os
+import argparse
+import atexit
+import csv
+import hashlib
+import json
+import math
+import re
+import string
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache, partial
+from io import BytesIO
 from dotenv import load_dotenv
 import google.generativeai as genai
 from PIL import Image
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import ee
+from geopy.adapters import RequestsAdapter
 from geopy.geocoders import Nominatim
 from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
 from phi.agent import Agent
 from phi.model.google import Gemini
 from phi.tools.tavily import TavilyTools
 from phi.tools.pubmed import PubmedTools
+from _common import RateLimiter, cache_get, cache_set
 
 # ---------- Initialize Environment ----------
 load_dotenv()
 
-# Initialize geocoder
-geolocator = Nominatim(user_agent="plant_health_monitor")
+# Initialize geocoder on a pooled requests session so lookups reuse keep-alive connections
+geolocator = Nominatim(
+    user_agent="plant_health_monitor",
+    adapter_factory=partial(RequestsAdapter, pool_connections=2, pool_maxsize=4, max_retries=2)
+)
+
+# Local gazetteer of common Indian locations, checked before any network geocoding
+GAZETTEER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "indian_cities.csv")
+
+def load_gazetteer(path=GAZETTEER_FILE):
+    """Load city coordinates keyed by the location strings users typically enter"""
+    gazetteer = {}
+    try:
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                coords = (float(row["lat"]), float(row["lon"]))
+                name, state = row["name"].lower(), row["state"].lower()
+                for key in (name, f"{name}, india", f"{name}, {state}", f"{name}, {state}, india"):
+                    gazetteer.setdefault(key, coords)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"⚠️ Could not load gazetteer: {str(e)}")
+    return gazetteer
+
+GAZETTEER = load_gazetteer()
+
+# Shared HTTP session so repeated API calls reuse pooled keep-alive connections
+http_session = requests.Session()
+http_adapter = HTTPAdapter(
+    pool_connections=4,
+    # Enough keep-alive sockets for every batch worker to hold one
+    pool_maxsize=10,
+    # Transient failures are retried with exponential backoff on the same connection
+    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+)
+http_session.mount("http://", http_adapter)
+http_session.mount("https://", http_adapter)
+atexit.register(http_session.close)
+
+# Earth Engine only needs to be initialized once per process
+_ee_initialized = False
+_ee_init_lock = threading.Lock()
+
+# Lifetimes of geocoding, weather and Gemini entries in the shared persistent cache
+GEOCODE_TTL = 30 * 24 * 3600  # Coordinates never change; keep for 30 days
+WEATHER_TTL = 3600  # Weather readings are valid for about an hour
+LLM_TTL = 7 * 24 * 3600  # Gemini answers for identical inputs are reused for a week
+
+# Area of interest around the location; farm-sized by default to keep EE reductions cheap
+DEFAULT_AOI_RADIUS_KM = 2
+KM_PER_DEGREE = 111.32
+SOIL_NATIVE_SCALE = 500  # metres per pixel of the soil datasets
+TARGET_PIXELS = 10_000
+
+# Gemini downsamples internally, so larger uploads only cost bandwidth
+MAX_IMAGE_SIZE = (1024, 1024)
+
+# Batch mode settings
+REPORTS_DIR = "reports"
+BATCH_WORKERS = 8
+OPENWEATHER_CALLS_PER_MINUTE = 60  # OpenWeather free tier limit
 
 # Configure Gemini Models
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 image_model = genai.GenerativeModel('gemini-1.5-flash')
 research_model = Gemini(api_key=os.getenv("GOOGLE_API_KEY"))
 
-# Setup Research Tools
-tools = [TavilyTools(api_key=os.getenv("TAVILY_API_KEY")), PubmedTools()]
-research_agent = Agent(tools=tools, model=research_model)
+# Setup Research Tools (built on first use; PubMed only when the symptoms call for it)
+# Whole words only, so e.g. "carrot" or "frustrated" don't pull in PubMed
+PUBMED_KEYWORDS = re.compile(
+    r"\b(?:fung(?:al|i|us|icides?)|bacteri(?:a|al|um)|virus(?:es)?|viral|pathogens?|pathogenic|"
+    r"blights?|rot(?:s|ten|ting)?|wilt(?:s|ed|ing)?|mildews?|rust(?:s|y)?|mosaic|cankers?|"
+    r"nematodes?|infect(?:s|ed|ion|ions|ious)?|lesions?|mou?lds?|mou?ldy|necro(?:sis|tic)|toxic(?:ity)?)\b",
+    re.IGNORECASE
+)
+_agent_local = threading.local()
+
+@lru_cache(maxsize=2)
+def get_research_tools(use_pubmed):
+    """Build the research toolset once, with or without PubMed"""
+    tools = [TavilyTools(api_key=os.getenv("TAVILY_API_KEY"))]
+    if use_pubmed:
+        tools.append(PubmedTools())
+    return tools
+
+def needs_pubmed(symptoms):
+    """Cheap screen for symptom text that benefits from scientific literature lookup"""
+    return bool(PUBMED_KEYWORDS.search(symptoms or ""))
+
+def get_research_agent(use_pubmed=True):
+    """Return this thread's research agent (phi Agents keep per-run state)"""
+    agents = getattr(_agent_local, "agents", None)
+    if agents is None:
+        agents = _agent_local.agents = {}
+    if use_pubmed not in agents:
+        agents[use_pubmed] = Agent(tools=get_research_tools(use_pubmed), model=research_model)
+    return agents[use_pubmed]
+
+# ---------- Rate Limiting ----------
+weather_rate_limiter = RateLimiter(OPENWEATHER_CALLS_PER_MINUTE, 60)
 
 # ---------- Crop Health Functions ----------
-def get_coordinates(location_name):
-    """Convert location name to coordinates and create a bounding box"""
+def geocode_location(location_name):
+    """Resolve a location name to (lat, lon)"""
+    normalized = " ".join(location_name.strip().lower().split())
+    if normalized in GAZETTEER:
+        return GAZETTEER[normalized]
+    
+    key = f"geo:{location_name.strip().lower()}"
+    cached = cache_get(key, GEOCODE_TTL)
+    if cached:
+        return cached
+    
     try:
         location = geolocator.geocode(location_name)
         if not location:
             raise ValueError("Location not found")
-        
-        # Create a ~20km × 20km area around the point
-        lat, lon = location.latitude, location.longitude
-        delta = 0.05  # ~5km in degrees
-        return ee.Geometry.Rectangle([
-            lon - delta, lat - delta, 
-            lon + delta, lat + delta
-        ]), lat, lon
+        coords = (location.latitude, location.longitude)
+        cache_set(key, coords)
+        return coords
     except (GeocoderTimedOut, GeocoderUnavailable) as e:
         print(f"⚠️ Geocoding service unavailable. Using default coordinates.")
         # Return default coordinates (center of Ahmednagar) if geocoding fails
-        return ee.Geometry.Rectangle([74.47, 19.07, 74.57, 19.17]), 19.12, 74.52
+        return 19.12, 74.52
     except Exception as e:
         print(f"⚠️ Geocoding error: {str(e)}")
         raise
 
+def make_aoi(lat, lon, radius_km=DEFAULT_AOI_RADIUS_KM):
+    """Create a square bounding box extending radius_km around the point"""
+    lat_delta = radius_km / KM_PER_DEGREE
+    # Degrees of longitude shrink with latitude
+    lon_delta = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    return ee.Geometry.Rectangle([
+        lon - lon_delta, lat - lat_delta, 
+        lon + lon_delta, lat + lat_delta
+    ])
+
+def get_coordinates(location_name, radius_km=DEFAULT_AOI_RADIUS_KM):
+    """Convert location name to coordinates and create a bounding box"""
+    lat, lon = geocode_location(location_name)
+    return make_aoi(lat, lon, radius_km), lat, lon
+
 def initialize_earth_engine():
-    """Initialize Google Earth Engine"""
-    try:
-        ee.Initialize(project='hackathon-457607')
-    except Exception as e:
+    """Initialize Google Earth Engine once per process"""
+    global _ee_initialized
+    with _ee_init_lock:
+        if _ee_initialized:
+            return True
         try:
-            ee.Authenticate(auth_mode="notebook")
             ee.Initialize(project='hackathon-457607')
-        except Exception as auth_error:
-            print(f"❌ Earth Engine authentication failed: {str(auth_error)}")
-            return False
+        except Exception as e:
+            try:
+                ee.Authenticate(auth_mode="notebook")
+                ee.Initialize(project='hackathon-457607')
+            except Exception as auth_error:
+                print(f"❌ Earth Engine authentication failed: {str(auth_error)}")
+                return False
+        _ee_initialized = True
     return True
 
 def get_weather(location_name, lat, lon):
-    """Get weather data for the specified location"""
+    """Get weather data for the specified location, cached per hour"""
+    hour_bucket = int(time.time() // WEATHER_TTL)
+    key = f"weather:{location_name.strip().lower()}:{hour_bucket}"
+    cached = cache_get(key, WEATHER_TTL)
+    if cached:
+        return cached
+    
+    result = _fetch_weather(location_name, lat, lon)
+    if not result["error"]:
+        cache_set(key, result)
+    return result
+
+def _fetch_weather(location_name, lat, lon):
+    """Fetch current weather from OpenWeather"""
     api_key = os.getenv("OPENWEATHER_API_KEY")
     if not api_key:
         return {
@@ -71,136 +214,137 @@ def get_weather(location_name, lat, lon):
             "data": None
         }
 
-    # Try with exact location name first, then fall back to coordinates
-    for query in [location_name, f"{lat},{lon}"]:
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={query}&appid={api_key}&units=metric"
+    url = "http://api.openweathermap.org/data/2.5/weather"
+    base_params = {"appid": api_key, "units": "metric"}
+    
+    try:
+        # Try with exact location name first; only fall back to coordinates
+        # when OpenWeather doesn't recognise the name
+        weather_rate_limiter.wait()
+        response = http_session.get(url, params={**base_params, "q": location_name}, timeout=5)
+        if response.status_code == 401:
+            return {
+                "error": "Invalid API Key (Unauthorized)",
+                "data": None
+            }
+        data = response.json()
         
-        try:
-            response = requests.get(url, timeout=5)
+        if data.get("cod") != 200:
+            weather_rate_limiter.wait()
+            response = http_session.get(url, params={**base_params, "lat": lat, "lon": lon}, timeout=5)
             data = response.json()
-
-            if response.status_code == 401:
-                return {
-                    "error": "Invalid API Key (Unauthorized)",
-                    "data": None
-                }
-
-            if data.get("cod") == 200:
-                return {
-                    "error": None,
-                    "data": {
-                        "temperature": data["main"]["temp"],
-                        "humidity": data["main"]["humidity"],
-                        "rainfall": data.get("rain", {}).get("1h", 0),
-                        "cloudiness": data.get("clouds", {}).get("all", 0),
-                        "weather_desc": data["weather"][0]["description"] if data.get("weather") else "N/A"
-                    }
-                }
-            elif query == f"{lat},{lon}":  # If both attempts failed
-                return {
-                    "error": f"Weather API error: {data.get('message', 'Unknown error')}",
-                    "data": None
-                }
-
-        except Exception as e:
-            if query == f"{lat},{lon}":  # If both attempts failed
-                return {
-                    "error": f"Weather request failed: {str(e)}",
-                    "data": None
-                }
-
-def get_soil_data(aoi):
-    """Get soil moisture and pH data from Earth Engine"""
-    datasets = [
-        {
-            "name": "Soil Moisture",
-            "collection": "NASA/SMAP/SPL4SMGP/007",
-            "date_range": ('2023-01-01', '2023-01-05'),  # Using static date for demo
-            "band": 'sm_surface',
-            "reducer": 'mean',
-            "scale": 1000
-        },
-        {
-            "name": "Soil pH",
-            "collection": "OpenLandMap/SOL/SOL_PH-H2O_USDA-4C1A2A_M/v02",
-            "date_range": None,
-            "band": 'b0',
-            "scale": 500,
-            "divide_by": 10  # New field to specify we need to divide pH values by 10
+    except Exception as e:
+        return {
+            "error": f"Weather request failed: {str(e)}",
+            "data": None
         }
-    ]
     
-    results = {}
-    
-    for ds in datasets:
-        try:
-            if ds['date_range']:
-                col = ee.ImageCollection(ds['collection']) \
-                      .filterDate(ds['date_range'][0], ds['date_range'][1]) \
-                      .select(ds['band'])
-                
-                if ds.get('reducer') == 'mean':
-                    img = col.mean().clip(aoi)
-                elif ds.get('reducer') == 'sum':
-                    img = col.sum().clip(aoi)
-                else:
-                    img = col.first().clip(aoi)
-            else:
-                img = ee.Image(ds['collection']).select([ds['band']]).clip(aoi)
-            
-            stats = img.reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=aoi,
-                scale=ds['scale'],
-                maxPixels=1e9,
-                bestEffort=True
-            )
-            
-            stats_info = stats.getInfo()
-            if stats_info:
-                value = list(stats_info.values())[0]
-                
-                # Convert soil moisture from m³/m³ to percentage
-                if ds['name'] == "Soil Moisture":
-                    results["soil_moisture"] = round(value * 100, 2)
-                # For pH, divide by 10 if the dataset specifies it
-                elif ds['name'] == "Soil pH":
-                    ph_value = value / ds.get('divide_by', 1)  # Divide by 10 if specified
-                    results["soil_ph"] = round(ph_value, 2)
-            
-        except Exception as e:
-            print(f"⚠️ Failed to process {ds['name']}: {str(e)}")
-            if ds['name'] == "Soil Moisture":
-                results["soil_moisture"] = None
-            else:
-                results["soil_ph"] = None
+    if data.get("cod") != 200:
+        return {
+            "error": f"Weather API error: {data.get('message', 'Unknown error')}",
+            "data": None
+        }
     
-    return results
-
-def get_weather_soil_data(location_name):
-    """Get combined weather and soil data"""
-    # Initialize Earth Engine
-    if not initialize_earth_engine():
-        return None
+    return {
+        "error": None,
+        "data": {
+            "temperature": data["main"]["temp"],
+            "humidity": data["main"]["humidity"],
+            "rainfall": data.get("rain", {}).get("1h", 0),
+            "cloudiness": data.get("clouds", {}).get("all", 0),
+            "weather_desc": data["weather"][0]["description"] if data.get("weather") else "N/A"
+        }
+    }
+
+def soil_scale(radius_km):
+    """Pick a reduction scale that keeps the AOI near TARGET_PIXELS pixels"""
+    area_m2 = (2 * radius_km * 1000) ** 2
+    return max(SOIL_NATIVE_SCALE, math.sqrt(area_m2 / TARGET_PIXELS))
+
+def soil_stats(aoi, radius_km=DEFAULT_AOI_RADIUS_KM):
+    """Build (without evaluating) the soil moisture/pH reduction for an AOI"""
+    # Soil moisture in m³/m³ (using static date for demo)
+    sm_img = ee.ImageCollection("NASA/SMAP/SPL4SMGP/007") \
+             .filterDate('2023-01-01', '2023-01-05') \
+             .select('sm_surface') \
+             .mosaic()  # Cheaper than a per-pixel mean over the short demo window
+    # OpenLandMap stores pH × 10
+    ph_img = ee.Image("OpenLandMap/SOL/SOL_PH-H2O_USDA-4C1A2A_M/v02") \
+             .select('b0') \
+             .divide(10)
     
-    # Get coordinates
+    # Stack both as named bands so a single reduction (one getInfo round-trip) covers them
+    combo = sm_img.rename('sm').addBands(ph_img.rename('ph')).clip(aoi)
+    return combo.reduceRegion(
+        reducer=ee.Reducer.mean(),
+        geometry=aoi,
+        scale=soil_scale(radius_km),
+        maxPixels=1e6,
+        bestEffort=True
+    )
+
+def parse_soil_stats(stats_info):
+    """Convert a soil reduction result into the soil_moisture/soil_ph fields"""
+    stats_info = stats_info or {}
+    moisture = stats_info.get('sm')
+    ph_value = stats_info.get('ph')
+    return {
+        # Convert soil moisture from m³/m³ to percentage
+        "soil_moisture": round(moisture * 100, 2) if moisture is not None else None,
+        "soil_ph": round(ph_value, 2) if ph_value is not None else None
+    }
+
+def get_soil_data(aoi, radius_km=DEFAULT_AOI_RADIUS_KM):
+    """Get soil moisture and pH data from Earth Engine"""
     try:
-        aoi, lat, lon = get_coordinates(location_name)
+        stats_info = soil_stats(aoi, radius_km).getInfo()
     except Exception as e:
-        print(f"❌ Failed to get coordinates for location: {str(e)}")
-        return None
+        print(f"⚠️ Failed to process soil data: {str(e)}")
+        return {"soil_moisture": None, "soil_ph": None}
+    return parse_soil_stats(stats_info)
+
+def get_soil_data_batch(aois, radius_km=DEFAULT_AOI_RADIUS_KM):
+    """Get soil data for many AOIs with a single Earth Engine request"""
+    if not aois:
+        return []
+    try:
+        # One ee.List evaluates every reduction in a single computeValue round-trip
+        stats_list = ee.List([soil_stats(aoi, radius_km) for aoi in aois]).getInfo()
+    except Exception as e:
+        print(f"⚠️ Failed to process batched soil data: {str(e)}")
+        return [{"soil_moisture": None, "soil_ph": None} for _ in aois]
+    return [parse_soil_stats(stats_info) for stats_info in stats_list]
+
+def get_weather_soil_data(location_name, radius_km=DEFAULT_AOI_RADIUS_KM, soil_data=None):
+    """Get combined weather and soil data (soil_data may be supplied if already fetched)"""
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # Earth Engine init and geocoding are independent, so overlap them
+        ee_future = executor.submit(initialize_earth_engine)
+        coords_future = executor.submit(geocode_location, location_name)
+        
+        if not ee_future.result():
+            return None
+        
+        try:
+            lat, lon = coords_future.result()
+        except Exception as e:
+            print(f"❌ Failed to get coordinates for location: {str(e)}")
+            return None
+        aoi = make_aoi(lat, lon, radius_km)
+        
+        # Weather and soil only need the coordinates, so fetch them concurrently
+        weather_future = executor.submit(get_weather, location_name, lat, lon)
+        soil_future = executor.submit(get_soil_data, aoi, radius_km) if soil_data is None else None
+        weather_result = weather_future.result()
+        if soil_future:
+            soil_data = soil_future.result()
     
-    # Get weather data
-    weather_result = get_weather(location_name, lat, lon)
     if weather_result["error"]:
         print(f"⚠️ Weather data unavailable: {weather_result['error']}")
         weather_data = None
     else:
         weather_data = weather_result["data"]
     
-    # Get soil data
-    soil_data = get_soil_data(aoi)
-    
     # Combine data
     combined_data = {}
     if weather_data:
@@ -211,15 +355,7 @@ def get_weather_soil_data(location_name):
     return combined_data if combined_data else None
 
 # ---------- Disease Detection Functions ----------
-def analyze_plant_image(img_path):
-    """Analyze plant image and extract symptoms"""
-    try:
-        img = Image.open(img_path)
-    except FileNotFoundError:
-        print(f"Error: Could not find image at {img_path}")
-        return None
-
-    prompt = """
+IMAGE_ANALYSIS_PROMPT = """
     Analyze this plant image and provide ONLY the following details in a clear, bullet-point format:
     - **Plant Name** (if identifiable)
     - **Growth Stage** (e.g., seedling, vegetative, flowering, fruiting)
@@ -228,39 +364,74 @@ def analyze_plant_image(img_path):
 
     Do NOT include treatment recommendations or unrelated explanations.
     """
+
+# Plant profile used when the image is diagnosed and researched in one call
+IMAGE_PLANT_PROFILE = """
+    See the attached plant image. First identify from it:
+    - Plant Name (if identifiable)
+    - Growth Stage (e.g., seedling, vegetative, flowering, fruiting)
+    - Visible Symptoms/Issues (e.g., curling, spots, discoloration)
+    - Possible Causes (e.g., fungal, bacterial, nutrient deficiency)
+    Start the report with these details, then follow the analysis guide below.
+    """
+
+def load_plant_image(img_path):
+    """Read a plant image, returning (raw bytes, downscaled RGB image) or None"""
+    try:
+        with open(img_path, 'rb') as f:
+            img_bytes = f.read()
+        img = Image.open(img_path)
+    except FileNotFoundError:
+        print(f"Error: Could not find image at {img_path}")
+        return None
+    
+    img.thumbnail(MAX_IMAGE_SIZE, Image.Resampling.LANCZOS)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img_bytes, img
+
+def analyze_plant_image(img_path):
+    """Analyze plant image and extract symptoms"""
+    loaded = load_plant_image(img_path)
+    if not loaded:
+        return None
+    img_bytes, img = loaded
+    
+    key = f"image:{hashlib.blake2b(img_bytes, digest_size=16).hexdigest()}"
+    cached = cache_get(key, LLM_TTL)
+    if cached:
+        return cached
     
     try:
-        response = image_model.generate_content([prompt, img])
+        response = image_model.generate_content([IMAGE_ANALYSIS_PROMPT, img])
+        cache_set(key, response.text)
         return response.text
     except Exception as e:
         print(f"Error generating response: {e}")
         return None
 
-def research_disease(symptoms, weather_soil_data=None):
-    """Get disease information based on symptoms and environmental conditions"""
-    env_context = ""
-    if weather_soil_data:
-        env_context = f"""
+# Prompt templates are parsed once at import; only the variable fields are filled per call
+ENV_CONTEXT_TEMPLATE = string.Template("""
         🌤️ Environmental Conditions:
-        - Temperature: {weather_soil_data.get('temperature', 'N/A')}°C
-        - Humidity: {weather_soil_data.get('humidity', 'N/A')}%
-        - Rainfall: {weather_soil_data.get('rainfall', 0)}mm
-        - Cloudiness: {weather_soil_data.get('cloudiness', 'N/A')}%
+        - Temperature: ${temperature}°C
+        - Humidity: ${humidity}%
+        - Rainfall: ${rainfall}mm
+        - Cloudiness: ${cloudiness}%
         
         🌱 Soil Conditions:
-        - Moisture: {weather_soil_data.get('soil_moisture', 'N/A')}%
-        - pH: {weather_soil_data.get('soil_ph', 'N/A')}
-        """
-    
-    prompt = f"""
+        - Moisture: ${soil_moisture}%
+        - pH: ${soil_ph}
+        """)
+
+RESEARCH_PROMPT_TEMPLATE = string.Template("""
     You are an expert agronomist with 20+ years of experience in organic farming and plant pathology. 
     Analyze this complete agricultural scenario & use Weather and Soil data to provide a comprehensive plant health report.
 
     🌿 PLANT PROFILE:
-    {symptoms}
+    $symptoms
 
     🌍 ENVIRONMENTAL CONTEXT:
-    {env_context if env_context else "⚠️ No environmental data available"}
+    $env_context
 
     📝 YOUR COMPREHENSIVE ANALYSIS GUIDE:
 
@@ -337,21 +508,151 @@ def research_disease(symptoms, weather_soil_data=None):
     - Adjust if rainfall >10mm
 
     -------------------------------------------
-"""
+""")
+
+def format_env_context(weather_soil_data):
+    """Format weather and soil data for inclusion in a prompt"""
+    if not weather_soil_data:
+        return "⚠️ No environmental data available"
+    return ENV_CONTEXT_TEMPLATE.substitute(
+        temperature=weather_soil_data.get('temperature', 'N/A'),
+        humidity=weather_soil_data.get('humidity', 'N/A'),
+        rainfall=weather_soil_data.get('rainfall', 0),
+        cloudiness=weather_soil_data.get('cloudiness', 'N/A'),
+        soil_moisture=weather_soil_data.get('soil_moisture', 'N/A'),
+        soil_ph=weather_soil_data.get('soil_ph', 'N/A')
+    )
+
+def build_research_prompt(symptoms, weather_soil_data=None):
+    """Build the comprehensive plant health analysis prompt"""
+    return RESEARCH_PROMPT_TEMPLATE.substitute(
+        symptoms=symptoms,
+        env_context=format_env_context(weather_soil_data)
+    )
+
+def stream_text(chunks):
+    """Echo streamed text chunks to stdout as they arrive and return the full text"""
+    parts = []
+    for text in chunks:
+        if text:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            parts.append(text)
+    sys.stdout.write("\n")
+    return "".join(parts)
+
+def research_disease(symptoms, weather_soil_data=None, stream=False):
+    """Get disease information based on symptoms and environmental conditions.
+    
+    With stream=True the answer is printed as it is generated (and still returned).
+    """
+    prompt = build_research_prompt(symptoms, weather_soil_data)
+    payload = symptoms + json.dumps(weather_soil_data, sort_keys=True)
+    key = f"research:{hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()}"
+    cached = cache_get(key, LLM_TTL)
+    if cached:
+        if stream:
+            print(cached)
+        return cached
+    
+    agent = get_research_agent(needs_pubmed(symptoms))
+    if stream:
+        content = stream_text(chunk.content for chunk in agent.run(prompt, stream=True))
+    else:
+        response = agent.run(prompt)
+        content = response.content if response else None
+    if not content:
+        return None
+    cache_set(key, content)
+    return content
 
-    print("\n🤖 Gemini AI Agent is analyzing with environmental context...\n")
-    response = research_agent.run(prompt)
-    return response.content if response else None
+def analyze_and_research(img_path, weather_soil_data=None, stream=False):
+    """Diagnose a plant image and generate the full health report in a single research-agent run"""
+    loaded = load_plant_image(img_path)
+    if not loaded:
+        return None
+    img_bytes, img = loaded
+    
+    payload = img_bytes + json.dumps(weather_soil_data, sort_keys=True).encode()
+    key = f"agent_report:{hashlib.blake2b(payload, digest_size=16).hexdigest()}"
+    cached = cache_get(key, LLM_TTL)
+    if cached:
+        if stream:
+            print(cached)
+        return cached
+    
+    prompt = build_research_prompt(IMAGE_PLANT_PROFILE, weather_soil_data)
+    # The agent gets the downscaled photo, so the report is still grounded in Tavily/PubMed searches
+    buf = BytesIO()
+    img.save(buf, "JPEG", quality=85)
+    images = [buf.getvalue()]
+    # The symptoms are only known once the image is read, so PubMed stays available
+    agent = get_research_agent(use_pubmed=True)
+    try:
+        if stream:
+            text = stream_text(chunk.content for chunk in agent.run(prompt, images=images, stream=True))
+        else:
+            response = agent.run(prompt, images=images)
+            text = response.content if response else None
+    except Exception as e:
+        print(f"Error generating response: {e}")
+        return None
+    if text:
+        cache_set(key, text)
+    return text
 
 # ---------- Main Integrated Function ----------
-def generate_plant_health_report(location_name, img_path=None, manual_symptoms=None):
+def collect_symptoms(img_path, image_analysis, manual_symptoms, weather_soil_data):
+    """Get plant symptoms from the image analysis or manual input.
+    
+    Returns (symptoms, prefetched) where prefetched is a future holding the
+    research for the image-derived symptoms if the user accepted them as-is.
+    """
+    prefetched = None
+    if img_path:
+        if image_analysis:
+            print("\n📋 Image Analysis Results:")
+            print(image_analysis)
+            
+            # Start researching the image-derived symptoms while the user reads them
+            executor = ThreadPoolExecutor(max_workers=1)
+            prefetched = executor.submit(research_disease, image_analysis, weather_soil_data)
+            executor.shutdown(wait=False)
+            
+            # Extract symptoms from analysis for research
+            symptoms = input("\n✏️ Please confirm or add to the symptoms from the image (press Enter to use analysis): ").strip()
+            if not symptoms:
+                symptoms = image_analysis
+            else:
+                # The user edited the symptoms, so the speculative result isn't used. The research
+                # is already running and can't be stopped; it runs to completion and its answer
+                # is only kept in the cache for the unedited analysis
+                prefetched = None
+        else:
+            symptoms = input("\n✏️ Please describe the plant's symptoms (e.g., yellow leaves on tomato): ").strip()
+    else:
+        symptoms = manual_symptoms if manual_symptoms else input("\n✏️ Please describe the plant's symptoms (e.g., yellow leaves on tomato): ").strip()
+    
+    return symptoms, prefetched
+
+def generate_plant_health_report(location_name, img_path=None, manual_symptoms=None, confirm_symptoms=False):
     """Generate comprehensive plant health report"""
     print("\n" + "="*50)
     print(f"🌿 Comprehensive Plant Health Report for: {location_name}")
     print("="*50 + "\n")
     
-    # Get environmental data
-    weather_soil_data = get_weather_soil_data(location_name)
+    # Without confirmation the image is diagnosed together with the report in one agent run;
+    # a missing image takes the two-step path, which falls back to manual symptom entry
+    fused = bool(img_path) and not confirm_symptoms and os.path.isfile(img_path)
+    
+    # Environmental data and image analysis hit different APIs, so run them side by side
+    if img_path and not fused:
+        print("🔍 Fetching environmental data and analyzing plant image...")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        env_future = executor.submit(get_weather_soil_data, location_name)
+        image_future = executor.submit(analyze_plant_image, img_path) if img_path and not fused else None
+        weather_soil_data = env_future.result()
+        image_analysis = image_future.result() if image_future else None
     
     # Print weather and soil data
     if weather_soil_data:
@@ -368,39 +669,144 @@ def generate_plant_health_report(location_name, img_path=None, manual_symptoms=N
     else:
         print("\n⚠️ Could not retrieve weather and soil data")
     
-    # Get plant symptoms either from image or manual input
-    if img_path:
-        print("\n🔍 Analyzing plant image...")
-        image_analysis = analyze_plant_image(img_path)
+    # Fresh analyses are streamed to the terminal as they are generated
+    if fused:
+        print("\n🤖 Gemini AI Agent is analyzing the plant image with environmental context...\n")
+        print("\n🎯 Comprehensive Plant Health Analysis:\n")
+        analysis = analyze_and_research(img_path, weather_soil_data, stream=True)
+    else:
+        symptoms, prefetched = collect_symptoms(img_path, image_analysis, manual_symptoms, weather_soil_data)
+        if not symptoms:
+            print("No symptoms provided. Exiting.")
+            return
         
-        if image_analysis:
-            print("\n📋 Image Analysis Results:")
-            print(image_analysis)
-            
-            # Extract symptoms from analysis for research
-            symptoms = input("\n✏️ Please confirm or add to the symptoms from the image (press Enter to use analysis): ").strip()
-            if not symptoms:
-                symptoms = image_analysis
+        # Generate comprehensive analysis
+        print("\n🤖 Gemini AI Agent is analyzing with environmental context...\n")
+        if prefetched:
+            analysis = prefetched.result()
+            if analysis:
+                print("\n🎯 Comprehensive Plant Health Analysis:\n")
+                print(analysis)
         else:
-            symptoms = input("\n✏️ Please describe the plant's symptoms (e.g., yellow leaves on tomato): ").strip()
+            print("\n🎯 Comprehensive Plant Health Analysis:\n")
+            analysis = research_disease(symptoms, weather_soil_data, stream=True)
+    
+    if not analysis:
+        print("Failed to generate analysis.")
+
+# ---------- Batch Processing ----------
+def build_report_markdown(location_name, img_path=None, symptoms=None, soil_data=None):
+    """Generate a plant health report without interactive prompts and return it as markdown"""
+    weather_soil_data = get_weather_soil_data(location_name, soil_data=soil_data)
+    
+    analysis = analyze_and_research(img_path, weather_soil_data) if img_path else None
+    # Rows whose image can't be read still get a report from their symptoms
+    if not analysis and symptoms:
+        analysis = research_disease(symptoms, weather_soil_data)
+    
+    lines = [f"# 🌿 Plant Health Report: {location_name}", ""]
+    if img_path:
+        lines.append(f"Image: `{img_path}`")
+    if symptoms:
+        lines.append(f"Symptoms: {symptoms}")
+    
+    lines += ["", "## 🌦️ Weather and Soil Conditions"]
+    if weather_soil_data:
+        lines += [
+            f"- Temperature: {weather_soil_data.get('temperature', 'N/A')}°C",
+            f"- Humidity: {weather_soil_data.get('humidity', 'N/A')}%",
+            f"- Rainfall: {weather_soil_data.get('rainfall', 0)}mm",
+            f"- Cloudiness: {weather_soil_data.get('cloudiness', 'N/A')}%",
+            f"- Weather Description: {weather_soil_data.get('weather_desc', 'N/A')}",
+            f"- Soil Moisture: {weather_soil_data.get('soil_moisture', 'N/A')}%",
+            f"- Soil pH: {weather_soil_data.get('soil_ph', 'N/A')}",
+        ]
     else:
-        symptoms = manual_symptoms if manual_symptoms else input("\n✏️ Please describe the plant's symptoms (e.g., yellow leaves on tomato): ").strip()
+        lines.append("⚠️ Could not retrieve weather and soil data")
     
-    if not symptoms:
-        print("No symptoms provided. Exiting.")
+    lines += ["", "## 🎯 Comprehensive Plant Health Analysis", ""]
+    lines.append(analysis if analysis else "Failed to generate analysis.")
+    return "\n".join(lines) + "\n"
+
+def prefetch_soil_data(locations):
+    """Geocode the given locations and fetch all their soil data in one Earth Engine call"""
+    resolved = {}
+    for location in locations:
+        try:
+            resolved[location] = geocode_location(location)
+        except Exception as e:
+            print(f"⚠️ Could not geocode {location}: {str(e)}")
+    
+    names = list(resolved)
+    aois = [make_aoi(lat, lon) for lat, lon in resolved.values()]
+    return dict(zip(names, get_soil_data_batch(aois)))
+
+def run_batch(csv_path, workers=BATCH_WORKERS):
+    """Generate reports for every row of a CSV with location, img_path and/or symptoms columns"""
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    if not rows:
+        print("No rows found in batch file.")
         return
     
-    # Generate comprehensive analysis
-    analysis = research_disease(symptoms, weather_soil_data)
+    # Pay the one-time Earth Engine setup before fanning out
+    if not initialize_earth_engine():
+        return
+    os.makedirs(REPORTS_DIR, exist_ok=True)
     
-    if analysis:
-        print("\n🎯 Comprehensive Plant Health Analysis:\n")
-        print(analysis)
-    else:
-        print("Failed to generate analysis.")
+    # Soil for every distinct location is reduced in one Earth Engine request
+    locations = [(row.get("location") or "").strip() or "Ahmednagar, India" for row in rows]
+    soil_by_location = prefetch_soil_data(sorted(set(locations)))
+    
+    def process(row_id, row, location):
+        report = build_report_markdown(
+            location,
+            img_path=(row.get("img_path") or "").strip() or None,
+            symptoms=(row.get("symptoms") or "").strip() or None,
+            soil_data=soil_by_location.get(location)
+        )
+        report_path = os.path.join(REPORTS_DIR, f"{row_id}.md")
+        with open(report_path, "w", encoding="utf-8") as out:
+            out.write(report)
+        return report_path
+    
+    print(f"📦 Processing {len(rows)} plants with up to {workers} workers...")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(process, (row.get("id") or "").strip() or str(i), row, location): i
+            for i, (row, location) in enumerate(zip(rows, locations), 1)
+        }
+        for future in as_completed(futures):
+            try:
+                print(f"✅ Saved {future.result()}")
+            except Exception as e:
+                print(f"❌ Row {futures[future]} failed: {str(e)}")
 
 # ---------- Command Line Interface ----------
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Integrated Plant Health Assistant")
+    parser.add_argument(
+        "--confirm-symptoms",
+        action="store_true",
+        help="Review and edit the symptoms extracted from the image before the full analysis"
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE.csv",
+        help="Generate reports for each row (location, img_path, symptoms) into the reports/ folder"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=BATCH_WORKERS,
+        help="Maximum number of plants processed concurrently in batch mode"
+    )
+    args = parser.parse_args()
+    
+    if args.batch:
+        run_batch(args.batch, workers=args.workers)
+        raise SystemExit(0)
+    
     print("🌿 Welcome to the Integrated Plant Health Assistant")
     
     # Get location
@@ -412,6 +818,6 @@ if __name__ == "__main__":
     img_path = input("\n🖼️ Enter path to plant image (or press Enter to describe symptoms manually): ").strip()
     
     if img_path:
-        generate_plant_health_report(location, img_path=img_path)
+        generate_plant_health_report(location, img_path=img_path, confirm_symptoms=args.confirm_symptoms)
     else:
-        generate_plant_health_report(location)
\ No newline at end of file
+        generate_plant_health_report(location)
@@ -1,55 +1,189 @@
 import os
+import atexit
+import hashlib
+import random
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dotenv import load_dotenv
-import google.generativeai as genai
-import ee
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
-from phi.agent import Agent
-from phi.model.google import Gemini
-from phi.tools.tavily import TavilyTools
 import requests
-from datetime import datetime, timedelta
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from datetime import datetime, timezone
+from _common import cache_get, cache_set
+
+# Earth Engine, geopy and phi are heavy to import, so they are loaded on first use
 
 # ---------- Initialize Environment ----------
 load_dotenv()
 
-# Initialize geocoder
-geolocator = Nominatim(user_agent="crop_planner")
+# Shared HTTP session so weather and forecast calls reuse one keep-alive connection
+http_session = requests.Session()
+http_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    # Transient failures are retried with exponential backoff on the same connection
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"]
+    )
+)
+http_session.mount("http://", http_adapter)
+http_session.mount("https://", http_adapter)
+atexit.register(http_session.close)
+
+# Lifetimes of geocoding, weather, soil and Gemini entries in the shared persistent cache
+GEOCODE_TTL = 30 * 24 * 3600  # Coordinates never change; keep for 30 days
+WEATHER_TTL = 600  # OpenWeather data is refreshed roughly every 10 minutes
+SOIL_TTL = 30 * 24 * 3600  # Soil layers are static datasets
+NDVI_TTL = 7 * 24 * 3600  # Past seasons' NDVI only changes as new imagery is ingested
+LLM_TTL = 7 * 24 * 3600  # Gemini answers for identical prompts are reused for a week
+# Set OPENWEATHER_ONECALL=1 when the API key has a One Call 3.0 subscription, so current weather
+# and the forecast come from one request; other keys only use the free 2.5 endpoints
+ONECALL_ENABLED = os.getenv("OPENWEATHER_ONECALL") == "1"
+
+# Planning prompts currently being answered, so identical concurrent requests share one call
+_inflight = {}
+_inflight_lock = threading.Lock()
 
-# Configure Gemini Models
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-planning_model = Gemini(api_key=os.getenv("GOOGLE_API_KEY"))
+# Geocoder and planning agents are created on first use
+_geocode = None
+_lazy_init_lock = threading.Lock()
+# phi Agents keep per-run state, so each thread gets its own planning agent
+_thread_local = threading.local()
 
-# Setup Research Tools
-tools = [TavilyTools(api_key=os.getenv("TAVILY_API_KEY"))]
-planning_agent = Agent(tools=tools, model=planning_model)
+# Formatting rules shared by every planning prompt
+DELIVERY_REQUIREMENTS = """
+DELIVERY REQUIREMENTS:
+- For all above planning, keep weather and soil data like temperature, humidity, rainfall, cloudiness, soil ph & moisture in mind
+- Use simple language (8th grade level), easy to understand, avoid jargon
+- Provide clear, actionable steps
+- Provide measurements in local units (kg, liters, etc.)
+- Include cost-effective solutions
+- Specify application frequency/dosage precisely
+- Mention safety precautions for all treatments
+- Format the following data properly with '-' symbol for subpoints. insert bullet point for only main heading and for subheading use star. Keep the text clear and professional. use emojis
+- separate sections with clear headings
+- Maintain clear and concise sentence structure.
+- remove markdown and align on the left side (subpoints also)
+"""
+
+# USDA texture classes indexed by the OpenLandMap class value (1-12)
+TEXTURE_CLASSES = (
+    None, "Clay", "Silty clay", "Sandy clay", "Clay loam", "Silty clay loam",
+    "Sandy clay loam", "Loam", "Silty loam", "Sandy loam", "Silt", "Loamy sand", "Sand"
+)
 
 # ---------- Helper Functions (Reused from plant health code) ----------
-def get_coordinates(location_name):
-    """Convert location name to coordinates and create a bounding box"""
+def _get_geocoder():
+    """Create the rate-limited Nominatim geocoder on first use"""
+    global _geocode
+    with _lazy_init_lock:
+        if _geocode is None:
+            from geopy.geocoders import Nominatim
+            from geopy.extra.rate_limiter import RateLimiter
+            
+            # Nominatim's usage policy allows at most 1 request per second
+            geolocator = Nominatim(user_agent="crop_planner")
+            # Transient geocoder errors are retried a few times before giving up
+            _geocode = RateLimiter(
+                geolocator.geocode,
+                min_delay_seconds=1,
+                max_retries=3,
+                error_wait_seconds=2.0,
+                swallow_exceptions=False
+            )
+    return _geocode
+
+def _get_agent():
+    """Return this thread's Gemini planning agent with Tavily search, creating it on first use"""
+    agent = getattr(_thread_local, "agent", None)
+    if agent is None:
+        from phi.agent import Agent
+        from phi.model.google import Gemini
+        from phi.tools.tavily import TavilyTools
+        
+        planning_model = Gemini(api_key=os.getenv("GOOGLE_API_KEY"))
+        tools = [TavilyTools(api_key=os.getenv("TAVILY_API_KEY"))]
+        agent = _thread_local.agent = Agent(tools=tools, model=planning_model)
+    return agent
+
+def geocode_location(location_name):
+    """Resolve a location name to (lat, lon)"""
+    from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
+    
+    key = f"geo:{location_name.strip().lower()}"
+    cached = cache_get(key, GEOCODE_TTL)
+    if cached:
+        return cached
+    
     try:
-        location = geolocator.geocode(location_name)
+        location = _get_geocoder()(location_name)
         if not location:
             raise ValueError("Location not found")
-        
-        # Create a ~20km × 20km area around the point
-        lat, lon = location.latitude, location.longitude
-        delta = 0.05  # ~5km in degrees
-        return ee.Geometry.Rectangle([
-            lon - delta, lat - delta, 
-            lon + delta, lat + delta
-        ]), lat, lon
+        coords = (location.latitude, location.longitude)
+        cache_set(key, coords)
+        return coords
     except (GeocoderTimedOut, GeocoderUnavailable) as e:
         print(f"⚠️ Geocoding service unavailable. Using default coordinates.")
         # Return default coordinates (center of Ahmednagar) if geocoding fails
-        return ee.Geometry.Rectangle([74.47, 19.07, 74.57, 19.17]), 19.12, 74.52
+        return 19.12, 74.52
     except Exception as e:
         print(f"⚠️ Geocoding error: {str(e)}")
         raise
 
+def make_aoi(lat, lon):
+    """Create a bounding box around the point"""
+    import ee
+    
+    # Create a ~20km × 20km area around the point
+    delta = 0.05  # ~5km in degrees
+    return ee.Geometry.Rectangle([
+        lon - delta, lat - delta, 
+        lon + delta, lat + delta
+    ])
+
+# Earth Engine reports rate limits and backend hiccups as EEExceptions with these messages;
+# other errors (bad asset, computation error) fail the same way on every attempt
+EE_TRANSIENT_MESSAGES = (
+    "too many concurrent", "too many requests", "rate limit", "429", "503",
+    "service unavailable", "internal error", "try again"
+)
+
+def is_transient_ee_error(error):
+    """True for Earth Engine failures that are worth retrying"""
+    import ee
+    
+    if isinstance(error, (ConnectionError, TimeoutError, requests.ConnectionError, requests.Timeout)):
+        return True
+    message = str(error).lower()
+    return isinstance(error, ee.EEException) and any(marker in message for marker in EE_TRANSIENT_MESSAGES)
+
+def ee_get_info(computed, attempts=3):
+    """Call getInfo() on an Earth Engine object, retrying transient failures with backoff"""
+    for attempt in range(attempts):
+        try:
+            return computed.getInfo()
+        except Exception as e:
+            if attempt == attempts - 1 or not is_transient_ee_error(e):
+                raise
+            # Exponential backoff (2s, 4s, ... capped at 10s) with jitter so parallel callers spread out
+            delay = min(10, 2 ** (attempt + 1)) * random.uniform(0.5, 1.0)
+            print(f"⚠️ Earth Engine request failed ({str(e)}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+def get_coordinates(location_name):
+    """Convert location name to coordinates and create a bounding box"""
+    lat, lon = geocode_location(location_name)
+    return make_aoi(lat, lon), lat, lon
+
 def initialize_earth_engine():
     """Initialize Google Earth Engine"""
+    import ee
+    
     try:
         ee.Initialize(project='hackathon-457607')
     except Exception as e:
@@ -61,8 +195,80 @@ def initialize_earth_engine():
             return False
     return True
 
-def get_weather(location_name, lat, lon):
-    """Get weather data for the specified location"""
+def get_weather_bundle(lat, lon):
+    """Get current weather and the forecast from one One Call request, cached for a few minutes"""
+    key = f"weather_bundle:{round(lat, 2)}:{round(lon, 2)}"
+    cached = cache_get(key, WEATHER_TTL)
+    if cached:
+        return cached
+    
+    result = _fetch_onecall(lat, lon)
+    if not result["error"]:
+        cache_set(key, result)
+    return result
+
+def _fetch_onecall(lat, lon):
+    """Fetch current weather and the daily forecast in one One Call 3.0 request"""
+    api_key = os.getenv("OPENWEATHER_API_KEY")
+    if not api_key:
+        return {"error": "API key not found in .env file", "data": None}
+    
+    url = f"https://api.openweathermap.org/data/3.0/onecall?lat={lat}&lon={lon}&exclude=minutely,hourly,alerts&appid={api_key}&units=metric"
+    
+    try:
+        response = http_session.get(url, timeout=5)
+        data = response.json()
+        
+        if response.status_code != 200:
+            return {"error": data.get('message', 'Unknown error'), "data": None}
+        
+        current = data['current']
+        # Daily entries cover the same days as the 2.5 forecast, in its record format
+        forecast = []
+        for item in data.get('daily', []):
+            forecast.append({
+                "datetime": datetime.fromtimestamp(item['dt'], timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                "temp": item['temp']['day'],
+                "humidity": item['humidity'],
+                "rain": item.get('rain', 0),
+                "description": item['weather'][0]['description']
+            })
+        
+        return {
+            "error": None,
+            "data": {
+                "current": {
+                    "temperature": current["temp"],
+                    "humidity": current["humidity"],
+                    "rainfall": current.get("rain", {}).get("1h", 0),
+                    "cloudiness": current.get("clouds", 0),
+                    "weather_desc": current["weather"][0]["description"] if current.get("weather") else "N/A"
+                },
+                "forecast": forecast
+            }
+        }
+    except Exception as e:
+        return {"error": str(e), "data": None}
+
+def get_weather(lat, lon):
+    """Get weather data for the specified location, cached for a few minutes"""
+    if ONECALL_ENABLED:
+        bundle = get_weather_bundle(lat, lon)
+        if not bundle["error"]:
+            return {"error": None, "data": bundle["data"]["current"]}
+    
+    key = f"weather:{round(lat, 2)}:{round(lon, 2)}"
+    cached = cache_get(key, WEATHER_TTL)
+    if cached:
+        return cached
+    
+    result = _fetch_weather(lat, lon)
+    if not result["error"]:
+        cache_set(key, result)
+    return result
+
+def _fetch_weather(lat, lon):
+    """Fetch current weather from the OpenWeather 2.5 endpoint"""
     api_key = os.getenv("OPENWEATHER_API_KEY")
     if not api_key:
         return {
@@ -70,140 +276,117 @@ def get_weather(location_name, lat, lon):
             "data": None
         }
 
-    # Try with exact location name first, then fall back to coordinates
-    for query in [location_name, f"{lat},{lon}"]:
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={query}&appid={api_key}&units=metric"
-        
-        try:
-            response = requests.get(url, timeout=5)
-            data = response.json()
-
-            if response.status_code == 401:
-                return {
-                    "error": "Invalid API Key (Unauthorized)",
-                    "data": None
-                }
+    # The coordinates are already resolved, so query by lat/lon directly
+    url = f"http://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={api_key}&units=metric"
+    
+    try:
+        response = http_session.get(url, timeout=5)
+        data = response.json()
 
-            if data.get("cod") == 200:
-                return {
-                    "error": None,
-                    "data": {
-                        "temperature": data["main"]["temp"],
-                        "humidity": data["main"]["humidity"],
-                        "rainfall": data.get("rain", {}).get("1h", 0),
-                        "cloudiness": data.get("clouds", {}).get("all", 0),
-                        "weather_desc": data["weather"][0]["description"] if data.get("weather") else "N/A"
-                    }
-                }
-            elif query == f"{lat},{lon}":  # If both attempts failed
-                return {
-                    "error": f"Weather API error: {data.get('message', 'Unknown error')}",
-                    "data": None
-                }
+        if response.status_code == 401:
+            return {
+                "error": "Invalid API Key (Unauthorized)",
+                "data": None
+            }
 
-        except Exception as e:
-            if query == f"{lat},{lon}":  # If both attempts failed
-                return {
-                    "error": f"Weather request failed: {str(e)}",
-                    "data": None
+        if data.get("cod") == 200:
+            return {
+                "error": None,
+                "data": {
+                    "temperature": data["main"]["temp"],
+                    "humidity": data["main"]["humidity"],
+                    "rainfall": data.get("rain", {}).get("1h", 0),
+                    "cloudiness": data.get("clouds", {}).get("all", 0),
+                    "weather_desc": data["weather"][0]["description"] if data.get("weather") else "N/A"
                 }
+            }
+        return {
+            "error": f"Weather API error: {data.get('message', 'Unknown error')}",
+            "data": None
+        }
 
-def get_soil_data(aoi):
-    """Get soil moisture and pH data from Earth Engine"""
-    datasets = [
-        {
-            "name": "Soil Moisture",
-            "collection": "NASA/SMAP/SPL4SMGP/007",
-            "date_range": ('2023-01-01', '2023-01-05'),  # Using static date for demo
-            "band": 'sm_surface',
-            "reducer": 'mean',
-            "scale": 1000
-        },
-        {
-            "name": "Soil pH",
-            "collection": "OpenLandMap/SOL/SOL_PH-H2O_USDA-4C1A2A_M/v02",
-            "date_range": None,
-            "band": 'b0',
-            "scale": 500,
-            "divide_by": 10  # New field to specify we need to divide pH values by 10
-        },
-        {
-            "name": "Soil Texture",
-            "collection": "OpenLandMap/SOL/SOL_TEXTURE-CLASS_USDA-TT_M/v02",
-            "date_range": None,
-            "band": 'b0',
-            "scale": 500
+    except Exception as e:
+        return {
+            "error": f"Weather request failed: {str(e)}",
+            "data": None
         }
-    ]
-    
-    results = {}
+
+def get_soil_data(lat, lon):
+    """Get soil data for the area around the point, cached per ~1 km tile"""
+    key = f"soil:{round(lat, 2)}:{round(lon, 2)}"
+    cached = cache_get(key, SOIL_TTL)
+    if cached:
+        return cached
+    
+    results = _fetch_soil_data(make_aoi(lat, lon))
+    if any(value is not None for value in results.values()):
+        cache_set(key, results)
+    return results
+
+def _fetch_soil_data(aoi):
+    """Get soil moisture, pH and texture data from Earth Engine"""
+    import ee
+    
+    # Stack all three layers into one image so a single reduceRegion/getInfo
+    # round-trip returns every value
+    # Using static date for demo
+    moisture_img = ee.ImageCollection("NASA/SMAP/SPL4SMGP/007") \
+        .filterDate('2023-01-01', '2023-01-05') \
+        .select('sm_surface') \
+        .mean() \
+        .rename('sm')
+    ph_img = ee.Image("OpenLandMap/SOL/SOL_PH-H2O_USDA-4C1A2A_M/v02").select(['b0']).rename('ph')
+    texture_img = ee.Image("OpenLandMap/SOL/SOL_TEXTURE-CLASS_USDA-TT_M/v02").select(['b0']).rename('tex')
+    
+    results = {"soil_moisture": None, "soil_ph": None, "soil_texture": None}
     
-    for ds in datasets:
-        try:
-            if ds['date_range']:
-                col = ee.ImageCollection(ds['collection']) \
-                      .filterDate(ds['date_range'][0], ds['date_range'][1]) \
-                      .select(ds['band'])
-                
-                if ds.get('reducer') == 'mean':
-                    img = col.mean().clip(aoi)
-                elif ds.get('reducer') == 'sum':
-                    img = col.sum().clip(aoi)
-                else:
-                    img = col.first().clip(aoi)
-            else:
-                img = ee.Image(ds['collection']).select([ds['band']]).clip(aoi)
-            
-            stats = img.reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=aoi,
-                scale=ds['scale'],
-                maxPixels=1e9,
-                bestEffort=True
-            )
-            
-            stats_info = stats.getInfo()
-            if stats_info:
-                value = list(stats_info.values())[0]
-                
-                # Convert soil moisture from m³/m³ to percentage
-                if ds['name'] == "Soil Moisture":
-                    results["soil_moisture"] = round(value * 100, 2)
-                # For pH, divide by 10 if the dataset specifies it
-                elif ds['name'] == "Soil pH":
-                    ph_value = value / ds.get('divide_by', 1)  # Divide by 10 if specified
-                    results["soil_ph"] = round(ph_value, 2)
-                # For soil texture, map values to texture classes
-                elif ds['name'] == "Soil Texture":
-                    texture_map = {
-                        1: "Clay",
-                        2: "Silty clay",
-                        3: "Sandy clay",
-                        4: "Clay loam",
-                        5: "Silty clay loam",
-                        6: "Sandy clay loam",
-                        7: "Loam",
-                        8: "Silty loam",
-                        9: "Sandy loam",
-                        10: "Silt",
-                        11: "Loamy sand",
-                        12: "Sand"
-                    }
-                    results["soil_texture"] = texture_map.get(round(value), "Unknown")
-            
-        except Exception as e:
-            print(f"⚠️ Failed to process {ds['name']}: {str(e)}")
-            if ds['name'] == "Soil Moisture":
-                results["soil_moisture"] = None
-            elif ds['name'] == "Soil pH":
-                results["soil_ph"] = None
-            elif ds['name'] == "Soil Texture":
-                results["soil_texture"] = None
+    try:
+        stats_info = ee_get_info(ee.Image.cat(moisture_img, ph_img, texture_img).clip(aoi).reduceRegion(
+            reducer=ee.Reducer.mean(),
+            geometry=aoi,
+            scale=500,
+            maxPixels=1e9,
+            bestEffort=True
+        ))
+    except Exception as e:
+        print(f"⚠️ Failed to process soil data: {str(e)}")
+        return results
+    
+    if not stats_info:
+        return results
+    
+    # Convert soil moisture from m³/m³ to percentage
+    if stats_info.get('sm') is not None:
+        results["soil_moisture"] = round(stats_info['sm'] * 100, 2)
+    # pH values are stored multiplied by 10
+    if stats_info.get('ph') is not None:
+        results["soil_ph"] = round(stats_info['ph'] / 10, 2)
+    # For soil texture, map values to texture classes
+    if stats_info.get('tex') is not None:
+        idx = round(stats_info['tex'])
+        results["soil_texture"] = TEXTURE_CLASSES[idx] if 1 <= idx <= 12 else "Unknown"
     
     return results
 
 def get_weather_forecast(lat, lon):
-    """Get 5-day weather forecast"""
+    """Get 5-day weather forecast, cached for a few minutes"""
+    if ONECALL_ENABLED:
+        bundle = get_weather_bundle(lat, lon)
+        if not bundle["error"]:
+            return {"error": None, "data": bundle["data"]["forecast"]}
+    
+    key = f"forecast:{round(lat, 2)}:{round(lon, 2)}"
+    cached = cache_get(key, WEATHER_TTL)
+    if cached:
+        return cached
+    
+    result = _fetch_weather_forecast(lat, lon)
+    if not result["error"]:
+        cache_set(key, result)
+    return result
+
+def _fetch_weather_forecast(lat, lon):
+    """Fetch the 5-day forecast from the OpenWeather 2.5 endpoint"""
     api_key = os.getenv("OPENWEATHER_API_KEY")
     if not api_key:
         return {"error": "API key not found", "data": None}
@@ -211,7 +394,7 @@ def get_weather_forecast(lat, lon):
     url = f"http://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&appid={api_key}&units=metric"
     
     try:
-        response = requests.get(url, timeout=5)
+        response = http_session.get(url, timeout=5)
         data = response.json()
         
         if response.status_code == 200:
@@ -232,19 +415,95 @@ def get_weather_forecast(lat, lon):
         return {"error": str(e), "data": None}
 
 # ---------- Crop Planning Functions ----------
-def get_historical_ndvi(aoi, years=3):
-    """Get historical NDVI trends for the area"""
+def soil_value(soil_data, key):
+    """Soil reading rounded to one decimal for prompts, so tiny changes keep the same prompt"""
+    value = soil_data.get(key)
+    if isinstance(value, (int, float)):
+        return round(value, 1)
+    return value if value is not None else 'N/A'
+
+def print_chunk(text):
+    """Write a streamed chunk of text to the terminal as soon as it arrives"""
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+def run_planning_agent(prompt, on_chunk=None):
+    """Run the planning agent, reusing the cached answer for an identical prompt.
+    
+    If on_chunk is given, it is called with each piece of the answer as it is generated.
+    """
+    key = f"llm:{hashlib.sha256(prompt.encode()).hexdigest()}"
+    cached = cache_get(key, LLM_TTL)
+    if cached:
+        if on_chunk:
+            on_chunk(cached)
+        return cached
+    
+    # If the same prompt is already being answered, wait for that result instead
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = Future()
+    if not owner:
+        content = future.result()
+        if on_chunk and content:
+            on_chunk(content)
+        return content
+    
+    try:
+        if on_chunk:
+            parts = []
+            for chunk in _get_agent().run(prompt, stream=True):
+                if chunk.content:
+                    on_chunk(chunk.content)
+                    parts.append(chunk.content)
+            content = "".join(parts) or None
+        else:
+            response = _get_agent().run(prompt)
+            content = response.content if response else None
+        if content:
+            cache_set(key, content)
+        future.set_result(content)
+        return content
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+def get_historical_ndvi(lat, lon, years=3):
+    """Get historical NDVI trends for the area around the point, cached per ~1 km tile"""
+    key = f"ndvi:{round(lat, 2)}:{round(lon, 2)}:{years}:{datetime.now().year}"
+    cached = cache_get(key, NDVI_TTL)
+    if cached:
+        return cached
+    
+    ndvi_data = _fetch_historical_ndvi(make_aoi(lat, lon), years)
+    if ndvi_data:
+        cache_set(key, ndvi_data)
+    return ndvi_data
+
+def _fetch_historical_ndvi(aoi, years):
+    """Compute seasonal NDVI means for the past years from Sentinel-2"""
+    import ee
+    
     try:
         # Get current year and previous years
         current_year = datetime.now().year
-        years_range = range(current_year - years, current_year)
+        years_range = list(range(current_year - years, current_year))
         
-        ndvi_data = {}
+        # Calculate NDVI with updated band names
+        def add_ndvi(image):
+            ndvi = image.normalizedDifference(['B8A', 'B4']).rename('NDVI')
+            return image.addBands(ndvi)
         
-        for year in years_range:
+        def seasonal_ndvi(year):
             # Define date range for the growing season (April to October)
-            start_date = f"{year}-04-01"
-            end_date = f"{year}-10-31"
+            year = ee.Number(year)
+            start_date = ee.Date.fromYMD(year, 4, 1)
+            end_date = ee.Date.fromYMD(year, 10, 31)
             
             # Load Sentinel-2 imagery (updated collection)
             sentinel = ee.ImageCollection('COPERNICUS/S2_HARMONIZED') \
@@ -252,27 +511,24 @@ def get_historical_ndvi(aoi, years=3):
                 .filterDate(start_date, end_date) \
                 .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20))
             
-            # Calculate NDVI with updated band names
-            def add_ndvi(image):
-                ndvi = image.normalizedDifference(['B8A', 'B4']).rename('NDVI')
-                return image.addBands(ndvi)
-            
-            sentinel_ndvi = sentinel.map(add_ndvi)
-            
             # Get mean NDVI for the season
-            mean_ndvi = sentinel_ndvi.select('NDVI').mean().clip(aoi)
+            mean_ndvi = sentinel.map(add_ndvi).select('NDVI').mean().clip(aoi)
             
-            # Calculate statistics
-            stats = mean_ndvi.reduceRegion(
+            return mean_ndvi.reduceRegion(
                 reducer=ee.Reducer.mean(),
                 geometry=aoi,
                 scale=10,
                 maxPixels=1e9
             )
-            
-            stats_info = stats.getInfo()
-            if stats_info:
-                ndvi_data[year] = round(stats_info['NDVI'], 3)
+        
+        # Build every year's reduction server-side and transfer them in one getInfo call
+        stats_list = ee_get_info(ee.List(years_range).map(seasonal_ndvi))
+        
+        ndvi_data = {
+            year: round(stats['NDVI'], 3)
+            for year, stats in zip(years_range, stats_list)
+            if stats and stats.get('NDVI') is not None
+        }
         
         return ndvi_data if ndvi_data else None
     
@@ -280,32 +536,28 @@ def get_historical_ndvi(aoi, years=3):
         print(f"⚠️ Failed to get historical NDVI: {str(e)}")
         return None
 
-def get_crop_calendar(location_name, crop_type=None):
-    """Get optimal planting and harvesting dates for crops in the region"""
-    aoi, lat, lon = get_coordinates(location_name)
+def get_crop_calendar(location_name, crop_type=None, on_chunk=None, geo=None, soil_data=None, forecast=None,
+                      ndvi_trends=None):
+    """Get optimal planting and harvesting dates for crops in the region.
     
-    # Get climate zone information
-    try:
-        climate_zone_img = ee.Image("USDOS/CDL/2018").clip(aoi)
-        climate_zone = climate_zone_img.reduceRegion(
-            reducer=ee.Reducer.mode(),
-            geometry=aoi,
-            scale=30
-        ).getInfo()
-        
-        # This is simplified - actual climate zone would require more complex analysis
-        climate_zone = "Tropical" if lat < 23.5 else "Temperate"
-    except:
-        climate_zone = "Unknown"
-    
-    # Get soil data
-    soil_data = get_soil_data(aoi)
-    
-    # Get historical NDVI trends
-    ndvi_trends = get_historical_ndvi(aoi)
-    
-    # Get weather forecast
-    forecast = get_weather_forecast(lat, lon)
+    geo (lat, lon), soil_data, forecast and ndvi_trends can be passed in when the caller already has them.
+    """
+    lat, lon = geo or geocode_location(location_name)
+    
+    # This is simplified - actual climate zone would require more complex analysis
+    climate_zone = "Tropical" if abs(lat) < 23.5 else ("Temperate" if abs(lat) < 50 else "Polar")
+    
+    # NDVI, soil and forecast are independent round-trips, so fetch them concurrently
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        ndvi_future = executor.submit(get_historical_ndvi, lat, lon) if ndvi_trends is None else None
+        soil_future = executor.submit(get_soil_data, lat, lon) if soil_data is None else None
+        forecast_future = executor.submit(get_weather_forecast, lat, lon) if forecast is None else None
+        if ndvi_future:
+            ndvi_trends = ndvi_future.result()
+        if soil_future:
+            soil_data = soil_future.result()
+        if forecast_future:
+            forecast = forecast_future.result()
     
     # Prepare context for AI
     context = f"""
@@ -313,9 +565,9 @@ def get_crop_calendar(location_name, crop_type=None):
     Climate Zone: {climate_zone}
     
     Soil Conditions:
-    - pH: {soil_data.get('soil_ph', 'N/A')}
-    - Texture: {soil_data.get('soil_texture', 'N/A')}
-    - Moisture: {soil_data.get('soil_moisture', 'N/A')}%
+    - pH: {soil_value(soil_data, 'soil_ph')}
+    - Texture: {soil_value(soil_data, 'soil_texture')}
+    - Moisture: {soil_value(soil_data, 'soil_moisture')}%
     
     Historical Vegetation Trends (NDVI):
     {ndvi_trends if ndvi_trends else "No historical data available"}
@@ -370,31 +622,17 @@ def get_crop_calendar(location_name, crop_type=None):
     
     Format the output clearly with sections for each crop, using simple language and local units of measurement.
     
-    DELIVERY REQUIREMENTS:
-    - For all above planning, keep weather and soil data like temperature, humidity, rainfall, cloudiness, soil ph & moisture in mind
-    - Use simple language (8th grade level), easy to understand, avoid jargon
-    - Provide clear, actionable steps
-    - Provide measurements in local units (kg, liters, etc.)
-    - Include cost-effective solutions
-    - Specify application frequency/dosage precisely
-    - Mention safety precautions for all treatments
-    - Format the following data properly with '-' symbol for subpoints. insert bullet point for only main heading and for subheading use star. Keep the text clear and professional. use emojis
-    - separate sections with clear headings
-    - Maintain clear and concise sentence structure.
-    - remove markdown and align on the left side (subpoints also)
-    
-    """
+    """ + DELIVERY_REQUIREMENTS
     
-    response = planning_agent.run(prompt)
-    return response.content if response else None
+    return run_planning_agent(prompt, on_chunk)
 
-def generate_irrigation_schedule(soil_data, weather_forecast, crop_type):
+def generate_irrigation_schedule(soil_data, weather_forecast, crop_type, on_chunk=None):
     """Generate customized irrigation schedule"""
     prompt = f"""
     Create a detailed irrigation schedule for {crop_type} based on:
-    - Soil type: {soil_data.get('soil_texture', 'Unknown')}
-    - Soil moisture: {soil_data.get('soil_moisture', 'N/A')}%
-    - pH: {soil_data.get('soil_ph', 'N/A')}
+    - Soil type: {soil_data.get('soil_texture') or 'Unknown'}
+    - Soil moisture: {soil_value(soil_data, 'soil_moisture')}%
+    - pH: {soil_value(soil_data, 'soil_ph')}
     - Upcoming weather: {weather_forecast['data'][0]['description'] if weather_forecast and weather_forecast['data'] else 'N/A'}
     
     Include:
@@ -404,35 +642,22 @@ def generate_irrigation_schedule(soil_data, weather_forecast, crop_type):
     4. Monitoring indicators (how to check if watering is adequate)
     5. Water conservation techniques
     
-    DELIVERY REQUIREMENTS:
-    - For all above planning, keep weather and soil data like temperature, humidity, rainfall, cloudiness, soil ph & moisture in mind
-    - Use simple language (8th grade level), easy to understand, avoid jargon
-    - Provide clear, actionable steps
-    - Provide measurements in local units (kg, liters, etc.)
-    - Include cost-effective solutions
-    - Specify application frequency/dosage precisely
-    - Mention safety precautions for all treatments
-    - Format the following data properly with '-' symbol for subpoints. insert bullet point for only main heading and for subheading use star. Keep the text clear and professional. use emojis       
-    - remove markdown and align on the left side (subpoints also)
-    - separate sections with clear headings
-    - Maintain clear and concise sentence structure.
-    
-    """
+    """ + DELIVERY_REQUIREMENTS
     
-    response = planning_agent.run(prompt)
-    return response.content if response else None
+    return run_planning_agent(prompt, on_chunk)
 
-def generate_crop_rotation_plan(location_name, current_crops, years=3):
+def generate_crop_rotation_plan(location_name, current_crops, years=3, on_chunk=None, geo=None, soil_data=None):
     """Generate multi-year crop rotation plan"""
-    aoi, lat, lon = get_coordinates(location_name)
-    soil_data = get_soil_data(aoi)
+    if soil_data is None:
+        lat, lon = geo or geocode_location(location_name)
+        soil_data = get_soil_data(lat, lon)
     
     prompt = f"""
     Create a {years}-year crop rotation plan for {location_name} with current crops: {', '.join(current_crops)}.
     
     Soil conditions:
-    - pH: {soil_data.get('soil_ph', 'N/A')}
-    - Texture: {soil_data.get('soil_texture', 'N/A')}
+    - pH: {soil_value(soil_data, 'soil_ph')}
+    - Texture: {soil_value(soil_data, 'soil_texture')}
     
     The plan should:
     1. Improve soil health over time
@@ -443,88 +668,107 @@ def generate_crop_rotation_plan(location_name, current_crops, years=3):
     
     Format as a clear yearly table with explanations for each rotation choice.
     
-    DELIVERY REQUIREMENTS:
-    - For all above planning, keep weather and soil data like temperature, humidity, rainfall, cloudiness, soil ph & moisture in mind
-    - Use simple language (8th grade level), easy to understand, avoid jargon
-    - Provide clear, actionable steps
-    - Provide measurements in local units (kg, liters, etc.)
-    - Include cost-effective solutions
-    - Specify application frequency/dosage precisely
-    - Mention safety precautions for all treatments
-    - Format the following data properly with '-' symbol for subpoints. insert bullet point for only main heading and for subheading use star. Keep the text clear and professional. use emojis    - separate sections with clear headings
-    - Maintain clear and concise sentence structure.
-    - remove markdown and align on the left side (subpoints also)
-    
-    """
+    """ + DELIVERY_REQUIREMENTS
     
-    response = planning_agent.run(prompt)
-    return response.content if response else None
+    return run_planning_agent(prompt, on_chunk)
 
 # ---------- Main Function ----------
-def generate_crop_plan(location_name, crop_type=None):
-    """Generate comprehensive crop plan for location"""
+def generate_crop_plan(location_name, crop_type=None, current_crops=None):
+    """Generate comprehensive crop plan for location.
+    
+    A rotation plan is included when current_crops is given.
+    """
     print("\n" + "="*50)
     print(f"🌱 Comprehensive Crop Plan for: {location_name}")
     if crop_type:
         print(f"🌾 Focus Crop: {crop_type}")
     print("="*50 + "\n")
     
-    # Initialize Earth Engine
-    if not initialize_earth_engine():
-        return None
-    
-    # Get coordinates
-    try:
-        aoi, lat, lon = get_coordinates(location_name)
-    except Exception as e:
-        print(f"❌ Failed to get coordinates for location: {str(e)}")
-        return None
-    
-    # Get soil data
-    print("\n🌱 Analyzing soil conditions...")
-    soil_data = get_soil_data(aoi)
-    if soil_data:
-        print(f"- pH: {soil_data.get('soil_ph', 'N/A')}")
-        print(f"- Texture: {soil_data.get('soil_texture', 'N/A')}")
-        print(f"- Moisture: {soil_data.get('soil_moisture', 'N/A')}%")
-    else:
-        print("⚠️ Could not retrieve soil data")
-    
-    # Get weather forecast
-    print("\n🌦️ Checking weather forecast...")
-    forecast = get_weather_forecast(lat, lon)
-    if forecast and forecast['data']:
-        print(f"- Next 5 days: {forecast['data'][0]['description']}")
-        print(f"- Temperature: {forecast['data'][0]['temp']}°C")
-        print(f"- Humidity: {forecast['data'][0]['humidity']}%")
-    else:
-        print("⚠️ Could not retrieve weather forecast")
-    
-    # Get crop calendar
-    print("\n📅 Generating crop calendar...")
-    calendar = get_crop_calendar(location_name, crop_type)
-    if calendar:
-        print("\n" + calendar)
-    else:
-        print("⚠️ Failed to generate crop calendar")
-    
-    # If specific crop provided, generate irrigation schedule
-    if crop_type:
-        print(f"\n💧 Generating irrigation schedule for {crop_type}...")
-        irrigation = generate_irrigation_schedule(soil_data, forecast, crop_type)
-        if irrigation:
-            print("\n" + irrigation)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        # Earth Engine init and geocoding are independent, so overlap them
+        ee_future = executor.submit(initialize_earth_engine)
+        coords_future = executor.submit(geocode_location, location_name)
+        
+        if not ee_future.result():
+            return None
+        
+        try:
+            lat, lon = coords_future.result()
+        except Exception as e:
+            print(f"❌ Failed to get coordinates for location: {str(e)}")
+            return None
+        
+        # Soil data, NDVI history and the forecast only need the coordinates, so fetch them
+        # concurrently; NDVI is only needed by the crop calendar, so it keeps running while
+        # the soil and weather summaries are printed
+        print("\n🌱 Analyzing soil conditions and 🌦️ checking weather forecast...")
+        soil_future = executor.submit(get_soil_data, lat, lon)
+        forecast_future = executor.submit(get_weather_forecast, lat, lon)
+        ndvi_future = executor.submit(get_historical_ndvi, lat, lon)
+        soil_data = soil_future.result()
+        forecast = forecast_future.result()
+        
+        # Print soil data
+        print("\n🌱 Soil conditions:")
+        if soil_data:
+            print(f"- pH: {soil_data.get('soil_ph', 'N/A')}")
+            print(f"- Texture: {soil_data.get('soil_texture', 'N/A')}")
+            print(f"- Moisture: {soil_data.get('soil_moisture', 'N/A')}%")
         else:
-            print("⚠️ Failed to generate irrigation schedule")
-    
-    # Generate rotation plan if requested
-    if input("\n🔄 Would you like a crop rotation plan? (y/n): ").lower() == 'y':
-        current_crops = input("Enter current crops (comma separated): ").split(',')
-        rotation_plan = generate_crop_rotation_plan(location_name, current_crops)
-        if rotation_plan:
-            print("\n" + rotation_plan)
+            print("⚠️ Could not retrieve soil data")
+        
+        # Print weather forecast
+        print("\n🌦️ Weather forecast:")
+        if forecast and forecast['data']:
+            print(f"- Next 5 days: {forecast['data'][0]['description']}")
+            print(f"- Temperature: {forecast['data'][0]['temp']}°C")
+            print(f"- Humidity: {forecast['data'][0]['humidity']}%")
+        else:
+            print("⚠️ Could not retrieve weather forecast")
+        
+        ndvi_trends = ndvi_future.result()
+    
+    # The plans are independent Gemini calls, so irrigation and rotation are generated
+    # in the background while the crop calendar streams to the terminal
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        irrigation_future = None
+        if crop_type:
+            irrigation_future = executor.submit(generate_irrigation_schedule, soil_data, forecast, crop_type)
+        rotation_future = None
+        if current_crops:
+            rotation_future = executor.submit(
+                generate_crop_rotation_plan, location_name, current_crops,
+                geo=(lat, lon), soil_data=soil_data
+            )
+        
+        # Get crop calendar, reusing the coordinates, soil data and forecast fetched above
+        print("\n📅 Generating crop calendar...\n")
+        calendar = get_crop_calendar(
+            location_name, crop_type, on_chunk=print_chunk,
+            geo=(lat, lon), soil_data=soil_data, forecast=forecast, ndvi_trends=ndvi_trends
+        )
+        if calendar:
+            print()
         else:
-            print("⚠️ Failed to generate rotation plan")
+            print("⚠️ Failed to generate crop calendar")
+        
+        # If specific crop provided, show irrigation schedule
+        if irrigation_future:
+            print(f"\n💧 Irrigation schedule for {crop_type}:")
+            irrigation = irrigation_future.result()
+            if irrigation:
+                print("\n" + irrigation)
+            else:
+                print("⚠️ Failed to generate irrigation schedule")
+        
+        # Show rotation plan if requested
+        if rotation_future:
+            print("\n🔄 Crop rotation plan:")
+            rotation_plan = rotation_future.result()
+            if rotation_plan:
+                print("\n" + rotation_plan)
+            else:
+                print("⚠️ Failed to generate rotation plan")
 
 # ---------- Command Line Interface ----------
 if __name__ == "__main__":
@@ -538,4 +782,9 @@ if __name__ == "__main__":
     # Get crop type (optional)
     crop_type = input("\n🌱 Enter specific crop type (or press Enter for general recommendations): ").strip()
     
-    generate_crop_plan(location, crop_type if crop_type else None)
\ No newline at end of file
+    # Ask about the rotation plan up front so every plan can be generated without pausing
+    current_crops = None
+    if input("\n🔄 Would you like a crop rotation plan? (y/n): ").lower() == 'y':
+        current_crops = [crop.strip() for crop in input("Enter current crops (comma separated): ").split(',') if crop.strip()]
+    
+    generate_crop_plan(location, crop_type if crop_type else None, current_crops)
\ No newline at end of file
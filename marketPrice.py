@@ -1,53 +1,71 @@
 import os
-from typing import Dict, Optional, Tuple, List
-from phi.agent import Agent
-from phi.model.google import Gemini
-from phi.tools.tavily import TavilyTools
+import argparse
+import atexit
+import hashlib
+import json
+import time
+from typing import Dict, Optional, List
 from datetime import datetime
 from PIL import Image
 import requests
+from requests.adapters import HTTPAdapter
 from io import BytesIO
 import google.generativeai as genai
+from google.api_core.exceptions import DeadlineExceeded, ResourceExhausted, ServiceUnavailable
 from dotenv import load_dotenv
 import re
-from collections import defaultdict
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from _common import DaemonExecutor, RateLimiter, cache_get, cache_set
+from _common_fetcher import _BaseFetcher
 
 # Load environment variables
 load_dotenv()
 
-class AgriculturalCommodityPriceFetcher:
+class BoundedCache:
+    """Thread-safe in-memory cache holding at most maxsize entries for up to ttl seconds, evicting the least recently used"""
+    
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] >= self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+    
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+# Lifetimes of price searches and image assessments in the shared persistent cache
+PRICE_TTL = 6 * 3600  # Mandi prices are refreshed a few times a day
+QUALITY_TTL = 7 * 24 * 3600  # The same image always gets the same assessment
+# Pre-fetched answers for the common commodities, refreshed out-of-band with --refresh-snapshot
+SNAPSHOT_FILE = "prices_snapshot.json"
+
+class AgriculturalCommodityPriceFetcher(_BaseFetcher):
     """
     An improved class to fetch agricultural commodity prices with multiple sources,
     latest date tracking, and robust fallback mechanisms.
     """
     
-    SYSTEM_PROMPT = """You are a highly specialized agricultural price analyst for Indian markets.
-Your goal is to provide the most accurate price in INR per **KILOGRAM (kg)** from multiple official sources.
-
-Follow these steps precisely:
-1. Search for the CURRENT/latest wholesale/mandi price for the commodity from at least 2-4 official sources (eNAM, Agmarknet, APMC data, government reports).
-2. For each source, extract:
-   - The price (likely in INR per Quintal (100 kg))
-   - The date of the price data
-   - The source name
-3. **For each source, convert the price to INR per kg** (divide quintal price by 100).
-4. Identify the most recent date among all sources.
-5. Provide your final response in the following strict format:
-
-**FOR SINGLE PRICES FROM MULTIPLE SOURCES:**
-PRICE_PER_KG: [price1_in_kg] | SOURCE: [source1] | DATE: [date1]
-PRICE_PER_KG: [price2_in_kg] | SOURCE: [source2] | DATE: [date2]
-...
-LATEST_DATE: [most_recent_date]
-
-**FOR PRICE RANGES:**
-MIN_PRICE_KG: [min_price_in_kg] | MAX_PRICE_KG: [max_price_in_kg] | SOURCE: [source] | DATE: [date]
-...
-LATEST_DATE: [most_recent_date]
-
-If after a thorough search, no current data is found from official sources, return the single phrase: 'Not available'.
-"""
-
     QUALITY_PROMPT = """You are an expert agricultural commodity quality assessor.
 First, reason step-by-step internally about the provided image. Then, provide your final assessment in the strict format below.
 
@@ -68,7 +86,40 @@ Damage Details: [Description of any damage, or "None"]
 Overall Assessment: [A brief one-sentence summary of the quality]
 """
     
-    QUALITY_PRICE_FACTORS = {'A': 1.15, 'B': 1.0, 'C': 0.85}
+    # Slow calls are abandoned after this many seconds; transient failures are retried with backoff
+    REQUEST_TIMEOUT_S = 15
+    # Price searches are multi-step Tavily + Gemini agent runs, so they get much longer
+    AGENT_TIMEOUT_S = 120
+    REQUEST_RETRIES = 2
+    # Failures worth another attempt; any other error would just happen again
+    _TRANSIENT_ERRORS = (ResourceExhausted, ServiceUnavailable, DeadlineExceeded, requests.ConnectionError, requests.Timeout)
+    # Sized for a full fetch_prices batch with speculative fallbacks (5 x 2 queries) plus image
+    # analysis, so calls never queue behind each other and eat into their own timeout; daemon
+    # workers, so a timed-out call doesn't hold up the exit
+    _call_executor = DaemonExecutor(max_workers=16)
+    
+    # Images are downscaled and re-encoded before upload; grading doesn't need full resolution
+    MAX_IMAGE_SIZE = (768, 768)
+    JPEG_QUALITY = 85
+    
+    # Shared HTTP session for image downloads, created on first use
+    _session: Optional[requests.Session] = None
+    _session_lock = threading.Lock()
+    # Recently downloaded image bytes per URL, so re-analyzing a URL soon after doesn't download it
+    # again; entries expire so a changed remote image is picked up
+    _url_bytes = BoundedCache(maxsize=32, ttl=600)
+    # Downscaled JPEG uploads by image sha256, kept until the image is graded successfully; bounded,
+    # so images that keep failing don't pile up
+    _encoded_images = BoundedCache(maxsize=16, ttl=600)
+    
+    # Price searches are spread out to stay within the Gemini/Tavily per-minute quotas
+    MAX_QPM = 30
+    
+    _ISO_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}$")
+    
+    # "Field: value" lines of the quality assessment
+    _QUALITY_FIELDS = frozenset({"Grade", "Moisture", "Foreign Matter", "Damage Details", "Overall Assessment"})
+    _QUALITY_LINE_RE = re.compile(r"^\s*([A-Za-z ]+?)\s*:\s*(.+?)\s*$", re.M)
     
     COMMON_COMMODITIES = [
         "Onion", "Potato", "Tomato", "Wheat", "Paddy (Rice)", "Maize", "Soybean", "Cotton", 
@@ -77,242 +128,349 @@ Overall Assessment: [A brief one-sentence summary of the quality]
     ]
     
     def __init__(self):
-        self.api_keys_configured = self._check_api_keys()
-        if self.api_keys_configured:
-            genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-        
-    def _check_api_keys(self) -> bool:
-        required_keys = {"TAVILY_API_KEY": os.getenv("TAVILY_API_KEY"), "GOOGLE_API_KEY": os.getenv("GOOGLE_API_KEY")}
-        missing_keys = [k for k, v in required_keys.items() if not v]
-        if missing_keys:
-            print(f"Warning: Missing API keys: {', '.join(missing_keys)}. Some services may not work.")
-            return False
-        return True
+        super().__init__()
+        # The vision model is stateless and shared by all threads
+        self._vision_model = genai.GenerativeModel('gemini-1.5-flash')
+        self._rate_limiter = RateLimiter(self.MAX_QPM, 60)
+        self._snapshot = self._load_snapshot()
+        # Price searches currently running, so identical concurrent requests share one search
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self._vision_warmed_up = False
     
+    def _warmup_vision(self):
+        """Open the Gemini connection with a (free) token count, so the grading request doesn't pay for it."""
+        try:
+            self._vision_model.count_tokens("ping")
+        except Exception:
+            pass  # Warmup is best-effort; real requests report their own errors
+        
+    def _load_snapshot(self) -> Dict:
+        """Load the price snapshot if one has been generated."""
+        try:
+            with open(SNAPSHOT_FILE, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not load price snapshot: {e}")
+            return {}
+
+    def refresh_price_snapshot(self, commodity_names: Optional[List[str]] = None):
+        """Re-run the price search for the common commodities and save the answers as the snapshot."""
+        commodity_names = commodity_names or self.COMMON_COMMODITIES
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            texts = dict(zip(commodity_names, executor.map(self._search_price_text, commodity_names)))
+        
+        snapshot = dict(self._snapshot)
+        for name, response_text in texts.items():
+            parsed_data = self._parse_price_response(response_text)
+            if parsed_data["prices"] or parsed_data["ranges"]:
+                snapshot[name.lower()] = {"ts": time.time(), "response_text": response_text}
+            else:
+                print(f"Warning: No price found for {name}, keeping the previous snapshot entry.")
+        
+        with open(SNAPSHOT_FILE, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, indent=2, ensure_ascii=False)
+        self._snapshot = snapshot
+
     def analyze_commodity_image(self, image_path: str) -> Dict[str, str]:
         """Analyze commodity image using Google's Generative AI with the improved prompt."""
+        if not self._vision_warmed_up:
+            # The Gemini connection is opened while the image is downloaded and decoded
+            self._vision_warmed_up = True
+            threading.Thread(target=self._warmup_vision, daemon=True).start()
         try:
-            img = self._load_image(image_path)
-            if isinstance(img, dict) and "error" in img: return img
+            image_bytes = self._read_image_bytes(image_path)
+            if isinstance(image_bytes, dict): return image_bytes
+            
+            # Identical images get the cached assessment instead of a new Gemini call
+            digest = hashlib.sha256(image_bytes).hexdigest()
+            key = f"quality:{digest}"
+            cached = cache_get(key, QUALITY_TTL)
+            if cached: return cached
             
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            response = model.generate_content([self.QUALITY_PROMPT, img])
-            return self._parse_quality_response(response.text)
+            # Images whose grading failed keep their decoded upload, so a retry skips the decode
+            img = self._encoded_images.get(digest)
+            if img is None:
+                img = self._load_image(image_bytes)
+                if "error" in img: return img
+                self._encoded_images.set(digest, img)
+            
+            response = self._call_with_timeout(self._vision_model.generate_content, [self.QUALITY_PROMPT, img])
+            quality_data = self._parse_quality_response(response.text)
+            if "error" not in quality_data:
+                cache_set(key, quality_data)
+                self._encoded_images.pop(digest)
+            return quality_data
             
         except Exception as e:
             return {"error": f"Image analysis failed: {str(e)}"}
     
-    def _load_image(self, image_path: str):
+    def analyze_commodity_images(self, image_paths: List[str], concurrency: int = 4) -> List[Dict[str, str]]:
+        """Analyze several commodity images concurrently, returning the assessments in input order."""
+        if len(image_paths) == 1:
+            return [self.analyze_commodity_image(image_paths[0])]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(self.analyze_commodity_image, image_paths))
+    
+    @classmethod
+    def _get_session(cls) -> requests.Session:
+        """Return the pooled HTTP session so repeat downloads reuse keep-alive connections."""
+        with cls._session_lock:
+            if cls._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                atexit.register(session.close)
+                cls._session = session
+        return cls._session
+    
+    def _read_image_bytes(self, image_path: str):
         try:
             if image_path.startswith(('http://', 'https://')):
-                response = requests.get(image_path, timeout=10)
+                image_bytes = self._url_bytes.get(image_path)
+                if image_bytes is not None:
+                    return image_bytes
+                response = self._get_session().get(image_path, timeout=10)
                 response.raise_for_status()
-                img = Image.open(BytesIO(response.content))
-            else:
-                if not os.path.exists(image_path): return {"error": f"Image file not found: {image_path}"}
-                img = Image.open(image_path)
-            return img.convert("RGB")
+                self._url_bytes.set(image_path, response.content)
+                return response.content
+            if not os.path.exists(image_path): return {"error": f"Image file not found: {image_path}"}
+            with open(image_path, "rb") as f:
+                return f.read()
+        except Exception as e:
+            return {"error": f"Image loading failed: {str(e)}"}
+    
+    def _load_image(self, image_bytes: bytes):
+        """Decode, downscale and JPEG-encode the image into an inline Gemini image part."""
+        try:
+            img = Image.open(BytesIO(image_bytes)).convert("RGB")
+            img.thumbnail(self.MAX_IMAGE_SIZE, Image.LANCZOS)
+            buf = BytesIO()
+            img.save(buf, "JPEG", quality=self.JPEG_QUALITY, optimize=True)
+            return {"mime_type": "image/jpeg", "data": buf.getvalue()}
         except Exception as e:
             return {"error": f"Image loading failed: {str(e)}"}
     
     def _parse_quality_response(self, response_text: str) -> Dict[str, str]:
-        quality_data = {}
-        fields = ["Grade", "Moisture", "Foreign Matter", "Damage Details", "Overall Assessment"]
-        for line in response_text.strip().split('\n'):
-            if ':' in line:
-                key, value = line.split(':', 1)
-                key = key.strip()
-                if key in fields:
-                    quality_data[key] = value.strip()
+        quality_data = {
+            key: value for key, value in self._QUALITY_LINE_RE.findall(response_text)
+            if key in self._QUALITY_FIELDS
+        }
         
         if "Grade" not in quality_data:
             return {"error": "Failed to parse quality analysis response from the AI."}
         return quality_data
 
-    def _parse_price_response(self, response_text: str) -> Dict:
-        """Parses the response with multiple sources and dates."""
-        data = {
-            "prices": [],
-            "ranges": [],
-            "latest_date": None,
-            "sources": set()
-        }
-        
-        if "not available" in response_text.lower():
-            return data
-        
-        try:
-            # Split into individual price entries
-            entries = [entry.strip() for entry in response_text.split('\n') if entry.strip()]
-            
-            for entry in entries:
-                if entry.startswith("LATEST_DATE:"):
-                    data["latest_date"] = entry.split(":", 1)[1].strip()
-                    continue
-                
-                parts = [p.strip() for p in entry.split('|')]
-                entry_data = {}
-                for part in parts:
-                    if ':' in part:
-                        key, value = part.split(':', 1)
-                        entry_data[key.strip()] = value.strip()
-                
-                if "PRICE_PER_KG" in entry_data:
-                    data["prices"].append(entry_data)
-                    data["sources"].add(entry_data.get("SOURCE", "Unknown"))
-                elif "MIN_PRICE_KG" in entry_data and "MAX_PRICE_KG" in entry_data:
-                    data["ranges"].append(entry_data)
-                    data["sources"].add(entry_data.get("SOURCE", "Unknown"))
+    def fetch_price(self, commodity_name: str, quality_data: Optional[Dict[str, str]] = None) -> Dict:
+        if not self.api_keys_configured: return {"error": "Error: API keys not configured properly"}
             
-            return data
+        try:
+            # The grade is applied locally, so every grade shares one base-price lookup
+            parsed_data = self.fetch_raw_price(commodity_name)
+            return self._apply_quality_adjustment(commodity_name, parsed_data, quality_data)
             
         except Exception as e:
-            print(f"Error parsing price response: {e}")
-            return data
+            return {"error": f"Error during price fetching: {str(e)}"}
 
-    def fetch_price(self, commodity_name: str, quality_data: Optional[Dict[str, str]] = None) -> str:
-        if not self.api_keys_configured: return "Error: API keys not configured properly"
-            
+    def fetch_prices(self, commodity_names: List[str], concurrency: int = 5) -> Dict[str, Dict]:
+        """Fetch prices for several commodities concurrently; a failure for one doesn't affect the rest."""
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {name: executor.submit(self.fetch_price, name) for name in dict.fromkeys(commodity_names)}
+        return {name: future.result() for name, future in futures.items()}
+
+    def fetch_raw_price(self, commodity_name: str) -> Dict:
+        """Return the parsed, unadjusted market prices from the cache, the snapshot or a fresh search."""
+        key = f"price:{commodity_name.strip().lower()}:{datetime.utcnow().strftime('%Y-%m-%d')}"
+        cached = cache_get(key, PRICE_TTL)
+        if cached: return cached
+        
+        # A fresh snapshot entry answers without any search
+        entry = self._snapshot.get(commodity_name.strip().lower())
+        if entry and time.time() - entry["ts"] < PRICE_TTL:
+            return self._parse_price_response(entry["response_text"])
+        
+        # If the same commodity is already being searched, wait for that result instead
+        inflight_key = commodity_name.strip().lower()
+        with self._inflight_lock:
+            future = self._inflight.get(inflight_key)
+            owner = future is None
+            if owner:
+                future = self._inflight[inflight_key] = Future()
+        if not owner:
+            return future.result()
+        
         try:
-            price_agent = Agent(
-                model=Gemini(model="gemini-1.5-flash"),
-                system_prompt=self.SYSTEM_PROMPT,
-                tools=[TavilyTools()],
-            )
-            
-            # Initial query for multiple sources
-            query = f"Current wholesale prices for {commodity_name} in India from 2-4 official sources with dates"
-            quality_grade = quality_data.get('Grade') if quality_data else None
-            if quality_grade: query += f" for quality similar to Grade {quality_grade}"
-            
-            response = price_agent.run(query)
-            response_text = str(response.content) if hasattr(response, 'content') else str(response)
+            parsed_data = self._parse_price_response(self._search_price_text(commodity_name))
+            if parsed_data["prices"] or parsed_data["ranges"]:
+                cache_set(key, parsed_data)
+            future.set_result(parsed_data)
+            return parsed_data
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[inflight_key]
 
-            # Fallback mechanism if initial search fails
-            if "not available" in response_text.lower():
-                print("\nInitial search was too specific. Trying a broader query...")
-                alt_query = f"Latest mandi prices for {commodity_name} in India from any reliable sources"
-                alt_response = price_agent.run(alt_query)
-                alt_text = str(alt_response.content) if hasattr(alt_response, 'content') else str(alt_response)
-                if "not available" not in alt_text.lower():
-                    response_text = alt_text
+    def _run_price_query(self, query: str) -> str:
+        return self._call_with_timeout(self._ask_price_agent, query, timeout=self.AGENT_TIMEOUT_S, rate_limited=True)
 
-            parsed_data = self._parse_price_response(response_text)
+    def _ask_price_agent(self, query: str) -> str:
+        """Run the query on this thread's price agent, creating it on first use.
+        
+        The answer is streamed and cut off as soon as the structured price block is complete,
+        so any trailing commentary isn't waited for.
+        """
+        response_text = ""
+        for chunk in self._get_price_agent().run(query, stream=True):
+            if chunk.content:
+                response_text += chunk.content
+                if self._has_complete_record(response_text):
+                    break
+        return response_text
+
+    def _has_complete_record(self, text: str) -> bool:
+        """True once the text holds a complete JSON answer, or a price entry and a finished LATEST_DATE line."""
+        if self._has_complete_json(text):
+            return True
+        latest = text.upper().rfind("LATEST_DATE")
+        if latest == -1 or "\n" not in text[latest:]:
+            return False
+        fields = {m.group(1).upper() for m in self._KV_RE.finditer(text)}
+        return "PRICE_PER_KG" in fields or {"MIN_PRICE_KG", "MAX_PRICE_KG"} <= fields
+
+    def _call_with_timeout(self, func, *args, timeout: Optional[float] = None, rate_limited: bool = False):
+        """Call func with a client-side timeout, retrying transient failures with exponential backoff.
+        
+        A timed-out attempt can't be stopped, so it is given up on rather than run again alongside itself.
+        """
+        timeout = timeout or self.REQUEST_TIMEOUT_S
+        for attempt in range(self.REQUEST_RETRIES + 1):
+            if rate_limited:
+                self._rate_limiter.wait()
+            # The call runs on a worker so a hung request can be abandoned rather than waited on
+            future = self._call_executor.submit(func, *args)
+            try:
+                return future.result(timeout=timeout)
+            except FuturesTimeoutError:
+                raise TimeoutError(f"Request timed out after {timeout} seconds")
+            except self._TRANSIENT_ERRORS:
+                if attempt == self.REQUEST_RETRIES:
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
+
+    def _apply_quality_adjustment(self, commodity_name: str, parsed_data: Dict, quality_data: Optional[Dict[str, str]] = None) -> Dict:
+        """Applies the quality grade multiplier to parsed prices and returns the price estimate."""
+        if not parsed_data["prices"] and not parsed_data["ranges"]:
+            return {"error": f"Price information for '{commodity_name}' is not available from official sources at this time."}
+
+        quality_grade = quality_data.get('Grade') if quality_data is not None else None
+        factor = self.QUALITY_PRICE_FACTORS.get(quality_grade, 1.0) if quality_grade else 1.0
+        result = {"kind": None, "price": None, "grade": quality_grade, "sources": [], "latest_date": None}
+        clean = self._PRICE_CLEAN_RE.sub
+        
+        # Process individual prices from multiple sources
+        if parsed_data["prices"]:
+            prices = []
+            total = 0.0
+            for price_data in parsed_data["prices"]:
+                try:
+                    price_kg = float(clean("", price_data["PRICE_PER_KG"])) * factor
+                except (ValueError, KeyError):
+                    continue
+                prices.append((price_kg, price_data))
+                total += price_kg
             
-            if not parsed_data["prices"] and not parsed_data["ranges"]:
-                return f"Price information for '{commodity_name}' is not available from official sources at this time."
+            if prices:
+                result["kind"] = "average"
+                result["price"] = total / len(prices)
+                result["sources"] = [
+                    {"price": price, "source": data.get("SOURCE", "Unknown"), "date": data.get("DATE", "N/A")}
+                    for price, data in prices[:3]  # Show top 3 sources
+                ]
 
-            final_price_info = []
-            quality_grade = quality_data.get('Grade') if quality_data else None
+        # Process price ranges
+        elif parsed_data["ranges"]:
+            ranges = []
+            min_total = max_total = 0.0
+            for range_data in parsed_data["ranges"]:
+                try:
+                    min_p = float(clean("", range_data["MIN_PRICE_KG"])) * factor
+                    max_p = float(clean("", range_data["MAX_PRICE_KG"])) * factor
+                except (ValueError, KeyError):
+                    continue
+                ranges.append((min_p, max_p, range_data))
+                min_total += min_p
+                max_total += max_p
             
-            # Process individual prices from multiple sources
-            if parsed_data["prices"]:
-                prices = []
-                for price_data in parsed_data["prices"]:
-                    try:
-                        price_kg = float(re.sub(r"[^\d.]", "", price_data["PRICE_PER_KG"]))
-                        if quality_grade:
-                            price_kg *= self.QUALITY_PRICE_FACTORS.get(quality_grade, 1.0)
-                        prices.append((price_kg, price_data))
-                    except (ValueError, KeyError):
-                        continue
-                
-                if prices:
-                    avg_price = sum(p[0] for p in prices) / len(prices)
-                    final_price_info.append(f"{avg_price:.2f} INR/kg (Average)")
-                    if quality_grade:
-                        final_price_info[-1] += f" (Adjusted for Grade {quality_grade})"
-                    
-                    for i, (price, data) in enumerate(prices[:3], 1):  # Show top 3 sources
-                        source = data.get("SOURCE", "Unknown")
-                        date = data.get("DATE", "N/A")
-                        final_price_info.append(f"  Source {i}: {price:.2f} INR/kg | {source} | {date}")
+            if ranges:
+                result["kind"] = "range"
+                result["price"] = (min_total / len(ranges), max_total / len(ranges))
+                result["sources"] = [
+                    {"price": (min_p, max_p), "source": data.get("SOURCE", "Unknown"), "date": data.get("DATE", "N/A")}
+                    for min_p, max_p, data in ranges[:3]  # Show top 3 sources
+                ]
 
-            # Process price ranges
-            elif parsed_data["ranges"]:
-                ranges = []
-                for range_data in parsed_data["ranges"]:
-                    try:
-                        min_p = float(re.sub(r"[^\d.]", "", range_data["MIN_PRICE_KG"]))
-                        max_p = float(re.sub(r"[^\d.]", "", range_data["MAX_PRICE_KG"]))
-                        if quality_grade:
-                            min_p *= self.QUALITY_PRICE_FACTORS.get(quality_grade, 1.0)
-                            max_p *= self.QUALITY_PRICE_FACTORS.get(quality_grade, 1.0)
-                        ranges.append((min_p, max_p, range_data))
-                    except (ValueError, KeyError):
-                        continue
-                
-                if ranges:
-                    avg_min = sum(r[0] for r in ranges) / len(ranges)
-                    avg_max = sum(r[1] for r in ranges) / len(ranges)
-                    final_price_info.append(f"{avg_min:.2f} - {avg_max:.2f} INR/kg (Range)")
-                    if quality_grade:
-                        final_price_info[-1] += f" (Adjusted for Grade {quality_grade})"
-                    
-                    for i, (min_p, max_p, data) in enumerate(ranges[:3], 1):  # Show top 3 sources
-                        source = data.get("SOURCE", "Unknown")
-                        date = data.get("DATE", "N/A")
-                        final_price_info.append(f"  Source {i}: {min_p:.2f}-{max_p:.2f} INR/kg | {source} | {date}")
+        if result["kind"] is None:
+            return {"error": f"Could not parse price data for '{commodity_name}'."}
 
-            # Add latest date information
-            if parsed_data["latest_date"]:
-                final_price_info.append(f"Latest Data Date: {parsed_data['latest_date']}")
-            elif parsed_data["prices"] or parsed_data["ranges"]:
-                dates = []
-                for price in parsed_data["prices"]:
-                    if "DATE" in price:
-                        dates.append(price["DATE"])
-                for range_data in parsed_data["ranges"]:
-                    if "DATE" in range_data:
-                        dates.append(range_data["DATE"])
-                if dates:
-                    latest_date = max(dates, key=lambda d: datetime.strptime(d, "%Y-%m-%d") if "-" in d else d)
-                    final_price_info.append(f"Latest Data Date: {latest_date}")
+        # Add latest date information
+        if parsed_data["latest_date"]:
+            result["latest_date"] = parsed_data["latest_date"]
+        else:
+            dates = []
+            for price in parsed_data["prices"]:
+                if "DATE" in price:
+                    dates.append(price["DATE"])
+            for range_data in parsed_data["ranges"]:
+                if "DATE" in range_data:
+                    dates.append(range_data["DATE"])
+            # ISO dates order correctly as strings; other formats are only used when there's no ISO date
+            iso_dates = [d for d in dates if self._ISO_DATE_RE.match(d)]
+            if iso_dates or dates:
+                result["latest_date"] = max(iso_dates or dates)
 
-            return "\n".join(final_price_info)
-            
-        except Exception as e:
-            return f"Error during price fetching: {str(e)}"
+        return result
 
-    def format_results(self, price_results: str, quality_data: Optional[Dict[str, str]] = None) -> str:
+    def format_results(self, price_result: Dict, quality_data: Optional[Dict[str, str]] = None) -> str:
         """Formats the price and quality results into a clean, readable output."""
         output = []
         
-        if "Error:" in price_results or "not available" in price_results:
-            output.append(f"⚠️ {price_results}")
-            if not quality_data:
+        if "error" in price_result:
+            output.append(f"⚠️ {price_result['error']}")
+            if quality_data is None:
                 output.append("\nℹ️ Note: For a quality-adjusted price, please provide a commodity image.")
             return "\n".join(output)
 
         output.append("--- PRICE ESTIMATE ---")
         
-        # Split the price results into lines
-        price_lines = [line.strip() for line in price_results.split('\n') if line.strip()]
-        
-        # The first line is the main price estimate
-        main_price_line = price_lines[0]
-        if "Average" in main_price_line:
-            output.append(f"💰 Average Price: {main_price_line.split('(')[0].strip()}")
-        elif "Range" in main_price_line:
-            output.append(f"📊 Price Range: {main_price_line.split('(')[0].strip()}")
+        # The main price estimate, then the individual source prices
+        if price_result["kind"] == "average":
+            output.append(f"💰 Average Price: {price_result['price']:.2f} INR/kg")
+            source_price = "{:.2f} INR/kg".format
+        else:
+            output.append("📊 Price Range: {:.2f} - {:.2f} INR/kg".format(*price_result["price"]))
+            source_price = lambda prices: "{:.2f}-{:.2f} INR/kg".format(*prices)
         
-        if quality_data:
+        if quality_data is not None:
             output.append(f"   (Quality Adjustment: Grade {quality_data.get('Grade', 'N/A')})")
         
-        # Add the individual source prices
-        for line in price_lines[1:]:
-            if line.startswith("Source"):
-                output.append(f"   - {line}")
-            elif line.startswith("Latest Data Date"):
-                output.append(f"\n📅 {line}")
+        output.extend(
+            f"   - Source {i}: {source_price(source['price'])} | {source['source']} | {source['date']}"
+            for i, source in enumerate(price_result["sources"], 1)
+        )
+        if price_result["latest_date"]:
+            output.append(f"\n📅 Latest Data Date: {price_result['latest_date']}")
 
-        if not quality_data:
+        if quality_data is None:
             output.append("\nℹ️ Note: Provide an image for a more precise, quality-adjusted price estimate.")
         
-        if quality_data and "error" not in quality_data:
+        if quality_data is not None and "error" not in quality_data:
             output.append("\n--- AI QUALITY ASSESSMENT ---")
-            for key, value in quality_data.items():
-                output.append(f"✅ {key}: {value}")
+            output.extend(f"✅ {key}: {value}" for key, value in quality_data.items())
         
         return "\n".join(output)
 
@@ -327,34 +485,64 @@ def main():
         
     print("\nCommon Commodities:", ", ".join(fetcher.COMMON_COMMODITIES[:10]) + ", etc.")
     
-    commodity_name = input("\nEnter commodity name: ").strip()
+    commodity_name = input("\nEnter commodity name (or several, comma separated): ").strip()
     if not commodity_name:
         print("Commodity name cannot be empty.")
         return
     
+    # Several commodities are looked up concurrently, without quality adjustment
+    commodity_names = [name.strip() for name in commodity_name.split(',') if name.strip()]
+    if len(commodity_names) > 1:
+        print(f"\nSearching for current market prices of {len(commodity_names)} commodities...")
+        for name, price_result in fetcher.fetch_prices(commodity_names).items():
+            print("\n" + "="*50)
+            print(f"      RESULTS FOR: {name.upper()}")
+            print("="*50)
+            print(fetcher.format_results(price_result))
+        print("="*50)
+        return
+    
     image_input = input("\nOptional: Path/URL to commodity image (or press Enter to skip): ").strip()
-    quality_data = {}
+    quality_data = None  # Stays None when there's no usable image assessment
     
-    if image_input:
-        print("\n🔬 Analyzing commodity image...")
-        quality_data = fetcher.analyze_commodity_image(image_input)
-        
-        if "error" in quality_data:
-            print(f"⚠️ Error: {quality_data['error']}")
-            print("Proceeding without quality data.")
-            quality_data = {}
-        else:
-            print("✔️ Analysis complete.")
-
+    # The price search doesn't depend on the image, so run it while the image is analyzed;
+    # the quality grade is applied to the prices once both are done
     print(f"\nSearching for current market price of {commodity_name}...")
-    price_string = fetcher.fetch_price(commodity_name, quality_data)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        price_future = executor.submit(fetcher.fetch_raw_price, commodity_name)
+        
+        if image_input:
+            print("\n🔬 Analyzing commodity image...")
+            quality_data = fetcher.analyze_commodity_image(image_input)
+            
+            if "error" in quality_data:
+                print(f"⚠️ Error: {quality_data['error']}")
+                print("Proceeding without quality data.")
+                quality_data = None
+            else:
+                print("✔️ Analysis complete.")
+        
+        try:
+            price_result = fetcher._apply_quality_adjustment(commodity_name, price_future.result(), quality_data)
+        except Exception as e:
+            price_result = {"error": f"Error during price fetching: {str(e)}"}
     
     print("\n" + "="*50)
     print(f"      RESULTS FOR: {commodity_name.upper()}")
     print("="*50)
-    final_output = fetcher.format_results(price_string, quality_data)
+    final_output = fetcher.format_results(price_result, quality_data)
     print(final_output)
     print("="*50)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Indian agricultural commodity price checker")
+    parser.add_argument("--refresh-snapshot", action="store_true",
+                        help=f"re-fetch prices for the common commodities into {SNAPSHOT_FILE} and exit")
+    args = parser.parse_args()
+    
+    if args.refresh_snapshot:
+        fetcher = AgriculturalCommodityPriceFetcher()
+        if fetcher.api_keys_configured:
+            fetcher.refresh_price_snapshot()
+    else:
+        main()
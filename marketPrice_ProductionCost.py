@@ -1,173 +1,98 @@
-import os
-from typing import Dict, Optional, Tuple, List
-from phi.agent import Agent
-from phi.model.google import Gemini
-from phi.tools.tavily import TavilyTools
+from typing import Dict, Tuple
 from datetime import datetime
-from PIL import Image
-import requests
-from io import BytesIO
-import google.generativeai as genai
 from dotenv import load_dotenv
-import re
-from collections import defaultdict
+from _common import DaemonExecutor
+from _common_fetcher import _BaseFetcher
 
 # Load environment variables
 load_dotenv()
 
-class AgriculturalCommodityPriceFetcher:
+class AgriculturalCommodityPriceFetcher(_BaseFetcher):
     """Class to fetch agricultural commodity prices"""
     
-    SYSTEM_PROMPT = """You are a highly specialized agricultural price analyst for Indian markets.
-Your goal is to provide the most accurate price in INR per **KILOGRAM (kg)** from multiple official sources.
-
-Follow these steps precisely:
-1. Search for the CURRENT/latest wholesale/mandi price for the commodity from at least 2-4 official sources (eNAM, Agmarknet, APMC data, government reports).
-2. For each source, extract:
-   - The price (likely in INR per Quintal (100 kg))
-   - The date of the price data
-   - The source name
-3. **For each source, convert the price to INR per kg** (divide quintal price by 100).
-4. Identify the most recent date among all sources.
-5. Provide your final response in the following strict format:
-
-**FOR SINGLE PRICES FROM MULTIPLE SOURCES:**
-PRICE_PER_KG: [price1_in_kg] | SOURCE: [source1] | DATE: [date1]
-PRICE_PER_KG: [price2_in_kg] | SOURCE: [source2] | DATE: [date2]
-...
-LATEST_DATE: [most_recent_date]
-
-**FOR PRICE RANGES:**
-MIN_PRICE_KG: [min_price_in_kg] | MAX_PRICE_KG: [max_price_in_kg] | SOURCE: [source] | DATE: [date]
-...
-LATEST_DATE: [most_recent_date]
-
-If after a thorough search, no current data is found from official sources, return the single phrase: 'Not available'.
-"""
-
-    QUALITY_PRICE_FACTORS = {'A': 1.15, 'B': 1.0, 'C': 0.85}
-    
     def __init__(self):
-        self.api_keys_configured = self._check_api_keys()
-        if self.api_keys_configured:
-            genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-        
-    def _check_api_keys(self) -> bool:
-        required_keys = {"TAVILY_API_KEY": os.getenv("TAVILY_API_KEY"), "GOOGLE_API_KEY": os.getenv("GOOGLE_API_KEY")}
-        missing_keys = [k for k, v in required_keys.items() if not v]
-        if missing_keys:
-            print(f"Warning: Missing API keys: {', '.join(missing_keys)}. Some services may not work.")
-            return False
-        return True
-    
-    def _parse_price_response(self, response_text: str) -> Dict:
-        """Parses the response with multiple sources and dates."""
-        data = {
-            "prices": [],
-            "ranges": [],
-            "latest_date": None,
-            "sources": set()
-        }
+        super().__init__()
+        # Found prices per (commodity, UTC day); mandi prices change daily, so the day in the key expires them
+        self._price_memo: Dict[Tuple[str, str], float] = {}
         
-        if "not available" in response_text.lower():
-            return data
+    def fetch_price(self, commodity_name: str, log=print) -> float:
+        """Fetch the average market price per quintal (100 kg) for the commodity.
         
-        try:
-            entries = [entry.strip() for entry in response_text.split('\n') if entry.strip()]
-            
-            for entry in entries:
-                if entry.startswith("LATEST_DATE:"):
-                    data["latest_date"] = entry.split(":", 1)[1].strip()
-                    continue
-                
-                parts = [p.strip() for p in entry.split('|')]
-                entry_data = {}
-                for part in parts:
-                    if ':' in part:
-                        key, value = part.split(':', 1)
-                        entry_data[key.strip()] = value.strip()
-                
-                if "PRICE_PER_KG" in entry_data:
-                    data["prices"].append(entry_data)
-                    data["sources"].add(entry_data.get("SOURCE", "Unknown"))
-                elif "MIN_PRICE_KG" in entry_data and "MAX_PRICE_KG" in entry_data:
-                    data["ranges"].append(entry_data)
-                    data["sources"].add(entry_data.get("SOURCE", "Unknown"))
-            
-            return data
-            
-        except Exception as e:
-            print(f"Error parsing price response: {e}")
-            return data
-
-    def fetch_price(self, commodity_name: str) -> float:
-        """Fetch the average market price per quintal (100 kg) for the commodity"""
+        Messages about fallbacks and default prices go to log.
+        """
         if not self.api_keys_configured: 
-            print("Error: API keys not configured properly. Using default price of ₹2000 per quintal.")
+            log("Error: API keys not configured properly. Using default price of ₹2000 per quintal.")
             return 2000  # Default price if API keys not configured
+        
+        memo_key = (commodity_name.strip().lower(), datetime.utcnow().strftime("%Y-%m-%d"))
+        if memo_key in self._price_memo:
+            return self._price_memo[memo_key]
             
         try:
-            price_agent = Agent(
-                model=Gemini(model="gemini-1.5-flash"),
-                system_prompt=self.SYSTEM_PROMPT,
-                tools=[TavilyTools()],
-            )
-            
-            query = f"Current wholesale prices for {commodity_name} in India from 2-4 official sources with dates"
-            response = price_agent.run(query)
-            response_text = str(response.content) if hasattr(response, 'content') else str(response)
-
-            # Fallback mechanism if initial search fails
-            if "not available" in response_text.lower():
-                print("\nInitial search was too specific. Trying a broader query...")
-                alt_query = f"Latest mandi prices for {commodity_name} in India from any reliable sources"
-                alt_response = price_agent.run(alt_query)
-                alt_text = str(alt_response.content) if hasattr(alt_response, 'content') else str(alt_response)
-                if "not available" not in alt_text.lower():
-                    response_text = alt_text
+            # The broader fallback query only runs alongside the specific one for commodities
+            # whose specific query often finds nothing
+            response_text = self._search_price_text(commodity_name, log)
 
             parsed_data = self._parse_price_response(response_text)
             
             if not parsed_data["prices"] and not parsed_data["ranges"]:
-                print(f"Price information for '{commodity_name}' is not available from official sources. Using default price of ₹2000 per quintal.")
+                log(f"Price information for '{commodity_name}' is not available from official sources. Using default price of ₹2000 per quintal.")
                 return 2000  # Default price if no data found
 
             # Process individual prices from multiple sources
+            # Only the mean is needed, so keep a running total and count instead of building lists
+            clean = self._PRICE_CLEAN_RE.sub
             if parsed_data["prices"]:
-                prices = []
+                total, count = 0.0, 0
                 for price_data in parsed_data["prices"]:
                     try:
-                        price_kg = float(re.sub(r"[^\d.]", "", price_data["PRICE_PER_KG"]))
-                        prices.append(price_kg)
+                        total += float(clean("", price_data["PRICE_PER_KG"]))
+                        count += 1
                     except (ValueError, KeyError):
                         continue
                 
-                if prices:
-                    avg_price_kg = sum(prices) / len(prices)
-                    return avg_price_kg * 100  # Convert back to quintal price
+                if count:
+                    avg_price_kg = total / count
+                    self._price_memo[memo_key] = avg_price_kg * 100  # Convert back to quintal price
+                    return self._price_memo[memo_key]
 
             # Process price ranges
             elif parsed_data["ranges"]:
-                ranges = []
+                total, count = 0.0, 0
                 for range_data in parsed_data["ranges"]:
                     try:
-                        min_p = float(re.sub(r"[^\d.]", "", range_data["MIN_PRICE_KG"]))
-                        max_p = float(re.sub(r"[^\d.]", "", range_data["MAX_PRICE_KG"]))
-                        ranges.append((min_p + max_p) / 2)  # Take average of range
+                        min_p = float(clean("", range_data["MIN_PRICE_KG"]))
+                        max_p = float(clean("", range_data["MAX_PRICE_KG"]))
                     except (ValueError, KeyError):
                         continue
+                    total += (min_p + max_p) / 2  # Take average of range
+                    count += 1
                 
-                if ranges:
-                    avg_price_kg = sum(ranges) / len(ranges)
-                    return avg_price_kg * 100  # Convert back to quintal price
+                if count:
+                    avg_price_kg = total / count
+                    self._price_memo[memo_key] = avg_price_kg * 100  # Convert back to quintal price
+                    return self._price_memo[memo_key]
 
-            print(f"Could not parse price data for '{commodity_name}'. Using default price of ₹2000 per quintal.")
+            log(f"Could not parse price data for '{commodity_name}'. Using default price of ₹2000 per quintal.")
             return 2000  # Fallback default price
             
         except Exception as e:
-            print(f"Error during price fetching: {str(e)}. Using default price of ₹2000 per quintal.")
+            log(f"Error during price fetching: {str(e)}. Using default price of ₹2000 per quintal.")
             return 2000  # Default price on error
 
+    def _run_price_query(self, query: str) -> str:
+        """Run the query on this thread's price agent, creating it on first use.
+        
+        The answer is streamed and cut off as soon as the JSON price object is complete.
+        """
+        response_text = ""
+        for chunk in self._get_price_agent().run(query, stream=True):
+            if chunk.content:
+                response_text += chunk.content
+                if self._has_complete_json(response_text):
+                    break
+        return response_text
+
 def calculate_seed_cost(seed_rate_kg, price_per_kg, area):
     return seed_rate_kg * price_per_kg * area
 
@@ -198,6 +123,12 @@ def calculate_transport_cost(transport_per_quintal, expected_yield):
 def calculate_other_costs(other_costs):
     return other_costs
 
+def calculate_totals(costs, expected_yield, selling_price):
+    """Return (total_cost, break_even_price, total_income, profit) for the cost items"""
+    total_cost = sum(costs)
+    total_income = selling_price * expected_yield
+    return total_cost, total_cost / expected_yield, total_income, total_income - total_cost
+
 def production_cost_calculator():
     print("\n🌾 Realistic Farm Production Cost Calculator")
     
@@ -205,14 +136,16 @@ def production_cost_calculator():
     price_fetcher = AgriculturalCommodityPriceFetcher()
     
     crop = input("Enter crop name: ")
-    area = float(input("Land area (in acres): "))
-    expected_yield = float(input("Expected total yield (quintals): "))
     
-    print(f"\nFetching current market price for {crop}...")
-    selling_price_per_quintal = price_fetcher.fetch_price(crop)
-    selling_price = selling_price_per_quintal  # Already in ₹/quintal
+    # The price lookup runs in the background while the remaining inputs are entered. Its messages
+    # are held until then so they don't interrupt the prompts, and its worker is a daemon so an
+    # invalid entry below exits straight away instead of waiting for the search
+    print(f"Fetching current market price for {crop} in the background...\n")
+    price_notices = []
+    price_future = DaemonExecutor(max_workers=1).submit(price_fetcher.fetch_price, crop, price_notices.append)
     
-    print(f"\nCurrent market price for {crop}: ₹{selling_price:.2f} per quintal")
+    area = float(input("Land area (in acres): "))
+    expected_yield = float(input("Expected total yield (quintals): "))
 
     # Inputs with logic
     seed_rate = float(input("\nSeed rate (kg/acre): "))
@@ -244,16 +177,19 @@ def production_cost_calculator():
     transport_cost = calculate_transport_cost(transport_per_quintal, expected_yield)
     other_cost = float(input("Other/Miscellaneous costs (insurance, interest, etc.): "))
 
-    # Total Cost
-    total_cost = sum([
-        seed_cost, fertilizer_cost, pesticide_cost,
-        water_cost, electricity_cost, labor_cost,
-        equipment_rent, land_rent, transport_cost, other_cost
-    ])
+    selling_price_per_quintal = price_future.result()
+    for notice in price_notices:
+        print(notice)
+    selling_price = selling_price_per_quintal  # Already in ₹/quintal
+    print(f"\nCurrent market price for {crop}: ₹{selling_price:.2f} per quintal")
 
-    break_even_price = total_cost / expected_yield
-    total_income = selling_price * expected_yield
-    profit = total_income - total_cost
+    # Total Cost
+    total_cost, break_even_price, total_income, profit = calculate_totals(
+        (seed_cost, fertilizer_cost, pesticide_cost,
+         water_cost, electricity_cost, labor_cost,
+         equipment_rent, land_rent, transport_cost, other_cost),
+        expected_yield, selling_price
+    )
 
     # Summary
     print("\n📋 Summary for Crop:", crop)
@@ -1,11 +1,17 @@
 import os
+import hashlib
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
 from dotenv import load_dotenv
-import google.generativeai as genai
-from PIL import Image
-from phi.agent import Agent
-from phi.model.google import Gemini
-from phi.tools.tavily import TavilyTools
-from phi.tools.pubmed import PubmedTools
+from _common import DaemonExecutor, cache_get, cache_set
+
+# Gemini, phi and Pillow are heavy to import, so they are loaded on first use
 
 # ---------- Step 1: Load API Keys ----------
 load_dotenv()
@@ -13,24 +19,87 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 
 # ---------- Step 2: Configure Gemini Models ----------
-genai.configure(api_key=GOOGLE_API_KEY)
-image_model = genai.GenerativeModel('gemini-1.5-flash')
-research_model = Gemini(api_key=GOOGLE_API_KEY)
+# Models and agents are built on first use, so importing this module stays cheap
+@lru_cache(maxsize=1)
+def get_image_model():
+    """Return the Gemini vision model, configuring the SDK on first use"""
+    import google.generativeai as genai
+    
+    # gRPC multiplexes concurrent calls (folder mode, warmup) over one HTTP/2 connection
+    genai.configure(api_key=GOOGLE_API_KEY, transport="grpc")
+    return genai.GenerativeModel('gemini-1.5-flash')
 
 # ---------- Step 3: Setup Research Tools ----------
-tools = [TavilyTools(api_key=TAVILY_API_KEY), PubmedTools()]
-research_agent = Agent(tools=tools, model=research_model)
+# phi Agents keep per-run state, so each thread (e.g. a research prefetch) gets its own agent
+_agent_local = threading.local()
 
-# ---------- Step 4: Image Analysis Function ----------
-def analyze_plant_image(img_path):
-    """Analyze plant image and extract symptoms"""
-    try:
-        img = Image.open(img_path)
-    except FileNotFoundError:
-        print(f"Error: Could not find image at {img_path}")
-        return None
+def get_research_agent():
+    """Return this thread's research agent with Tavily and PubMed tools, creating it on first use"""
+    agent = getattr(_agent_local, "agent", None)
+    if agent is None:
+        from phi.agent import Agent
+        from phi.model.google import Gemini
+        from phi.tools.tavily import TavilyTools
+        from phi.tools.pubmed import PubmedTools
+        
+        research_model = Gemini(api_key=GOOGLE_API_KEY)
+        tools = [TavilyTools(api_key=TAVILY_API_KEY), PubmedTools()]
+        agent = _agent_local.agent = Agent(tools=tools, model=research_model)
+    return agent
+
+# At most this many Gemini requests run at once; further callers queue instead of hitting 429s
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "2"))
+_gemini_slots = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY)
+
+def call_gemini(func, *args, attempts=5, streamed=None):
+    """Call a Gemini-backed function within the concurrency limit, backing off on rate-limit errors.
+    
+    streamed is the list a streaming func collects its shown output in; once it holds anything the
+    call isn't retried, since the retry would show the answer again from the start.
+    """
+    from google.api_core.exceptions import ResourceExhausted
+    
+    for attempt in range(attempts):
+        try:
+            with _gemini_slots:
+                return func(*args)
+        except ResourceExhausted as e:
+            if attempt == attempts - 1 or streamed:
+                raise
+            # Exponential backoff (2s, 4s, ... capped at 60s) with jitter so parallel callers spread out
+            delay = min(60, 2 ** (attempt + 1)) * random.uniform(0.5, 1.0)
+            print(f"⚠️ Gemini rate limit reached ({str(e)}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
 
-    prompt = """
+# ---------- Step 4: Response Cache ----------
+# Lifetimes of entries in the shared persistent cache (AGRIVERSE_NO_CACHE=1 bypasses it)
+IMAGE_ANALYSIS_TTL = 30 * 24 * 3600  # The same photo always shows the same symptoms
+RESEARCH_TTL = 7 * 24 * 3600  # Disease research for the same symptoms is reused for a week
+FAILURE_TTL = 600  # Images that can't be decoded aren't retried for 10 minutes
+
+# Filler words that don't change which symptoms are described
+_SYMPTOM_STOPWORDS = frozenset({"a", "an", "the", "and", "or", "of", "on", "in", "with", "is", "are", "my", "its", "has", "have"})
+_WORD_RE = re.compile(r"[a-z0-9]+")
+# Research answers already produced in this session, by symptom_key
+_research_memo = {}
+
+def symptom_key(symptoms):
+    """Cache key that ignores case, punctuation, spacing and filler words, but keeps word order"""
+    words = [word for word in _WORD_RE.findall(symptoms.lower()) if word not in _SYMPTOM_STOPWORDS]
+    return "research:" + hashlib.sha256(" ".join(words).encode()).hexdigest()
+
+def print_chunk(text):
+    """Write a streamed chunk of text to the terminal as soon as it arrives"""
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+# ---------- Step 5: Image Analysis Function ----------
+# Photos are downscaled and re-encoded before upload; symptom detection doesn't need full resolution
+MAX_IMAGE_SIZE = (1024, 1024)
+JPEG_QUALITY = 85
+
+# Built once at import, like the research prompt
+IMAGE_PROMPT = """
     Analyze this plant image and provide ONLY the following details in a clear, bullet-point format:
     - **Plant Name** (if identifiable)
     - **Visible Symptoms/Issues** (e.g., curling, spots, discoloration)
@@ -38,18 +107,80 @@ def analyze_plant_image(img_path):
 
     Do NOT include treatment recommendations or unrelated explanations.
     """
+# Hash state of the prompt, so cache keys only need to hash the image bytes on each call
+_IMAGE_PROMPT_HASH = hashlib.sha256(IMAGE_PROMPT.encode())
+
+def prepare_image(image_bytes):
+    """Downscale and JPEG-encode the image into an inline Gemini image part"""
+    from PIL import Image
     
+    img = Image.open(BytesIO(image_bytes))  # Only reads the header
+    # Photos that are already small enough are uploaded as-is, skipping the decode/re-encode
+    if img.format in ("JPEG", "PNG", "WEBP") and img.width <= MAX_IMAGE_SIZE[0] and img.height <= MAX_IMAGE_SIZE[1]:
+        return {"mime_type": Image.MIME[img.format], "data": image_bytes}
+    # JPEGs are decoded straight at a reduced scale (libjpeg DCT scaling) instead of at full size
+    img.draft("RGB", MAX_IMAGE_SIZE)
+    img = img.convert("RGB")
+    img.thumbnail(MAX_IMAGE_SIZE, Image.LANCZOS)
+    buf = BytesIO()
+    img.save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    return {"mime_type": "image/jpeg", "data": buf.getvalue()}
+
+def analyze_plant_image(img_path, on_chunk=None):
+    """Analyze plant image and extract symptoms.
+    
+    If on_chunk is given, it is called with each piece of the analysis as it is generated.
+    """
     try:
-        response = image_model.generate_content([prompt, img])
-        return response.text
+        with open(img_path, "rb") as f:
+            image_bytes = f.read()
+    except FileNotFoundError:
+        print(f"Error: Could not find image at {img_path}")
+        return None
+    
+    # The same photo with the same prompt gets the stored analysis; prompt edits change the key
+    digest = _IMAGE_PROMPT_HASH.copy()
+    digest.update(image_bytes)
+    key = f"plant_image:{digest.hexdigest()}"
+    cached = cache_get(key, IMAGE_ANALYSIS_TTL)
+    if cached:
+        if on_chunk:
+            on_chunk(cached)
+        return cached
+    # An image that couldn't be decoded recently isn't tried again until the failure expires
+    if cache_get(f"{key}:failed", FAILURE_TTL):
+        print("Error: This file could not be read as an image a few minutes ago.")
+        return None
+    
+    pieces = []
+    
+    def generate(parts):
+        if not on_chunk:
+            return get_image_model().generate_content(parts).text
+        for chunk in get_image_model().generate_content(parts, stream=True):
+            on_chunk(chunk.text)
+            pieces.append(chunk.text)
+        return "".join(pieces)
+    
+    try:
+        img = prepare_image(image_bytes)
+    except (OSError, ValueError) as e:  # Includes PIL's UnidentifiedImageError and truncated files
+        print(f"Error: Could not read image: {e}")
+        # Only decode failures are remembered; they fail the same way every time
+        cache_set(f"{key}:failed", True)
+        return None
+    
+    try:
+        text = call_gemini(generate, [IMAGE_PROMPT, img], streamed=pieces)
+        cache_set(key, text)
+        return text
     except Exception as e:
         print(f"Error generating response: {e}")
         return None
 
-# ---------- Step 5: Disease Research Function ----------
-def research_disease(symptoms):
-    """Get disease information based on symptoms"""
-    prompt = f"""
+# ---------- Step 6: Disease Research Function ----------
+# Built once at import; only the symptoms are filled in per call
+RESEARCH_PROMPT = """
     You are a plant disease expert.
 
     The plant shows the following symptoms: "{symptoms}"
@@ -83,42 +214,118 @@ def research_disease(symptoms):
     - don't include step1, step2, step3, treatment1, treatment2, treatment3
     """
 
-    print("\n🤖 Gemini AI Agent is analyzing using Tavily + PubMed...\n")
-    response = research_agent.run(prompt)
-    return response.content if response else None
+def research_disease(symptoms, on_chunk=None):
+    """Get disease information based on symptoms.
+    
+    If on_chunk is given, it is called with each piece of the answer as it is generated.
+    """
+    # Already-researched symptoms get the stored answer, from memory within this session and
+    # from the persistent cache otherwise
+    key = symptom_key(symptoms)
+    cached = _research_memo.get(key) or cache_get(key, RESEARCH_TTL)
+    if cached:
+        _research_memo[key] = cached
+        if on_chunk:
+            on_chunk(cached)
+        return cached
+
+    parts = []
+    
+    def run(prompt):
+        if not on_chunk:
+            response = get_research_agent().run(prompt)
+            return response.content if response else None
+        for chunk in get_research_agent().run(prompt, stream=True):
+            if chunk.content:
+                on_chunk(chunk.content)
+                parts.append(chunk.content)
+        return "".join(parts) or None
+
+    content = call_gemini(run, RESEARCH_PROMPT.format_map({"symptoms": symptoms}), streamed=parts)
+    if content:
+        cache_set(key, content)
+        _research_memo[key] = content
+    return content
+
+# ---------- Step 7: Main Function ----------
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+def analyze_image_directory(dir_path):
+    """Analyze every image in a directory concurrently, printing each result in file order"""
+    img_paths = sorted(
+        os.path.join(dir_path, name) for name in os.listdir(dir_path)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    if not img_paths:
+        print(f"No images found in {dir_path}")
+        return
+    
+    print(f"\n🔍 Analyzing {len(img_paths)} plant images...")
+    # Workers beyond the Gemini concurrency limit would only wait on it
+    with ThreadPoolExecutor(max_workers=GEMINI_MAX_CONCURRENCY) as executor:
+        for img_path, image_analysis in zip(img_paths, executor.map(analyze_plant_image, img_paths)):
+            print(f"\n📋 {os.path.basename(img_path)}:")
+            print(image_analysis or "Failed to analyze this image.")
+
+def warmup():
+    """Import phi, build the image model and open the Gemini connection, so the first real call doesn't pay for it"""
+    try:
+        get_research_agent()  # Builds this thread's agent, loading phi and its tools for everyone
+        get_image_model().count_tokens("ping")
+    except Exception:
+        pass  # Warmup is best-effort; real calls report their own errors
 
-# ---------- Step 6: Main Function ----------
 def main():
     print("🌿 Welcome to the Plant Disease Assistant")
     
+    # Set-up runs in the background while the user is typing
+    threading.Thread(target=warmup, daemon=True).start()
+    
     # Get image path from user
-    img_path = input("🖼️ Enter path to plant image (or press Enter to describe symptoms manually): ").strip()
+    img_path = input("🖼️ Enter path to plant image or a folder of images (or press Enter to describe symptoms manually): ").strip()
+    
+    if img_path and os.path.isdir(img_path):
+        analyze_image_directory(img_path)
+        return
     
+    prefetched = None
     if img_path:
-        # Analyze image
+        # Analyze image, showing the results as they are generated
         print("\n🔍 Analyzing plant image...")
-        image_analysis = analyze_plant_image(img_path)
+        print("\n📋 Image Analysis Results:")
+        image_analysis = analyze_plant_image(img_path, on_chunk=print_chunk)
+        print()
         
         if image_analysis:
-            print("\n📋 Image Analysis Results:")
-            print(image_analysis)
+            # Research the analysed symptoms while the user reads and confirms them; it is the
+            # research the unedited analysis gets anyway, so it can't contradict the analysis
+            prefetched = DaemonExecutor(max_workers=1).submit(research_disease, image_analysis)
             
             # Extract symptoms from analysis for research
             symptoms = input("\n✏️ Please confirm or add to the symptoms from the image (press Enter to use analysis): ").strip()
             if not symptoms:
                 symptoms = image_analysis
+            else:
+                # Edited symptoms get their own research. The running prefetch can't be stopped;
+                # it finishes in the background and is only kept in the cache for the analysis
+                prefetched = None
         else:
             symptoms = input("\n✏️ Please describe the plant's symptoms (e.g., yellow leaves on tomato): ").strip()
     else:
         symptoms = input("\n✏️ Please describe the plant's symptoms (e.g., yellow leaves on tomato): ").strip()
     
     if symptoms:
-        # Research disease based on symptoms
-        research_results = research_disease(symptoms)
-        if research_results:
-            print("\n🎯 Diagnosis & Recommendations:\n")
-            print(research_results)
+        # Research disease based on symptoms, showing the answer as it is generated
+        print("\n🤖 Gemini AI Agent is analyzing using Tavily + PubMed...\n")
+        print("\n🎯 Diagnosis & Recommendations:\n")
+        if prefetched:
+            research_results = prefetched.result()
+            if research_results:
+                print(research_results)
         else:
+            research_results = research_disease(symptoms, on_chunk=print_chunk)
+            print()
+        if not research_results:
             print("Failed to get disease information.")
     else:
         print("No symptoms provided. Exiting.")